@@ -1,6 +1,10 @@
+import hashlib
 import os
+import sqlite3
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from datasets import Dataset
 
@@ -17,6 +21,54 @@ from ragas.metrics import (
 )
 
 
+EMBED_MODEL_NAME = 'BAAI/bge-small-en-v1.5'
+EMBED_CACHE_PATH = Path(__file__).parent / '.cache' / 'query_embeddings.sqlite'
+
+
+def encode_queries_cached(retriever, queries, cache_path: Path = EMBED_CACHE_PATH):
+    """
+    Encode queries, reusing embeddings stored by earlier evaluation runs.
+    
+    Embeddings are kept in a small SQLite table keyed on the SHA1 of the
+    model name, embedding backend and query text, so edits to a question
+    or a backend switch re-encode only what changed.
+    
+    Args:
+        retriever: MedlineRetriever used to encode cache misses
+        queries: List of query strings
+        cache_path: SQLite file holding cached embeddings
+    
+    Returns:
+        np.ndarray: float32 array of shape (len(queries), dim)
+    """
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    backend = os.environ.get('DOCTORBOT_EMBED_BACKEND', 'torch')
+    keys = [
+        hashlib.sha1(f"{EMBED_MODEL_NAME}|{backend}|{query}".encode('utf-8')).hexdigest()
+        for query in queries
+    ]
+    
+    with sqlite3.connect(cache_path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        placeholders = ','.join('?' * len(keys))
+        cached = dict(conn.execute(
+            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys
+        ))
+        
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if missing:
+            new_embeddings = retriever.encode_queries([queries[i] for i in missing], batch_size=32)
+            for i, embedding in zip(missing, new_embeddings):
+                cached[keys[i]] = embedding.astype(np.float32).tobytes()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(keys[i], cached[keys[i]]) for i in missing]
+            )
+    
+    print(f"   ✓ Query embeddings: {len(queries) - len(missing)} cached, {len(missing)} encoded")
+    return np.stack([np.frombuffer(cached[key], dtype=np.float32) for key in keys])
+
+
 def create_test_cases():
     """Create test cases for evaluation."""
     test_cases = [
@@ -59,35 +111,40 @@ def run_evaluation():
     test_cases = create_test_cases()
     
     # Prepare data for RAGAS
-    questions = []
-    answers = []
+    questions = [test_case["question"] for test_case in test_cases]
+    ground_truths = [test_case["ground_truth"] for test_case in test_cases]
     contexts = []
-    ground_truths = []
     
     print("\n🔄 Running RAG pipeline on test cases...\n")
     
-    for i, test_case in enumerate(test_cases, 1):
-        question = test_case["question"]
-        ground_truth = test_case["ground_truth"]
-        
+    # Encode every question in one batch, skipping ones cached by earlier runs
+    query_embeddings = encode_queries_cached(pipeline.retriever, questions)
+    
+    for i, (question, query_embedding) in enumerate(zip(questions, query_embeddings), 1):
         print(f"Test Case {i}/{len(test_cases)}: {question[:50]}...")
         
         # Get retrieval results
-        results = pipeline.retriever.retrieve(question, top_k=3)
-        context = [result['text'] for result in results]
-        
-        # Generate answer
-        result = pipeline.generate_diagnosis(question)
-        answer = result['diagnosis']
-        
-        # Store for RAGAS
-        questions.append(question)
-        answers.append(answer)
-        contexts.append(context)
-        ground_truths.append(ground_truth)
+        results = pipeline.retriever.retrieve_with_embedding(query_embedding, top_k=3)
+        contexts.append([result['text'] for result in results])
         
-        print(f"  ✓ Retrieved {len(context)} contexts")
-        print(f"  ✓ Generated answer ({len(answer)} chars)\n")
+        print(f"  ✓ Retrieved {len(contexts[-1])} contexts")
+    
+    # Generate answers concurrently - each one waits on an LLM API call.
+    # The embeddings computed above are reused instead of re-encoding.
+    print(f"\n🤖 Generating {len(questions)} answers in parallel...")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        diagnoses = list(executor.map(
+            lambda question, query_embedding: pipeline.generate_diagnosis(
+                question, query_embedding=query_embedding
+            ),
+            questions,
+            query_embeddings
+        ))
+    answers = [result['diagnosis'] for result in diagnoses]
+    
+    for i, answer in enumerate(answers, 1):
+        print(f"  ✓ Test Case {i}: generated answer ({len(answer)} chars)")
+    print()
     
     # Create RAGAS dataset
     data = {
@@ -1,18 +1,74 @@
+import hashlib
+import json
+import os
+import sys
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
+
+# Run as a script from rag/, so make the project root importable
+PROJECT_ROOT = str(Path(__file__).parent.parent)
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from rag.embedding_backend import load_embedding_model, is_onnx_model, select_device
 import faiss
+import torch
 import pickle
 from tqdm import tqdm
 
-def build_faiss_index(chunks_df: pd.DataFrame, model_name: str = "BAAI/bge-small-en-v1.5"):
+
+# Word-count buckets and the batch-size multiplier used for each one
+LENGTH_BUCKETS = [(0, 128, 4), (128, 256, 2), (256, 512, 1), (512, None, 1)]
+
+
+def _encode_length_bucketed(model: SentenceTransformer, texts: list, batch_size: int) -> np.ndarray:
+    """
+    Encode texts grouped by length so batches carry little padding.
+    
+    Short chunks get proportionally larger batches. Results are written
+    back through the original positions, so row i still matches texts[i].
+    """
+    lengths = np.array([len(t.split()) for t in texts])
+    embeddings = None
+    
+    for low, high, multiplier in LENGTH_BUCKETS:
+        mask = lengths >= low if high is None else (lengths >= low) & (lengths < high)
+        positions = np.flatnonzero(mask)
+        if len(positions) == 0:
+            continue
+        
+        print(f"   - {len(positions)} chunks with {low}-{high or '∞'} words")
+        bucket_embeddings = model.encode(
+            [texts[i] for i in positions],
+            show_progress_bar=True,
+            batch_size=batch_size * multiplier,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        if embeddings is None:
+            embeddings = np.empty((len(texts), bucket_embeddings.shape[1]), dtype=bucket_embeddings.dtype)
+        embeddings[positions] = bucket_embeddings
+    
+    return embeddings
+
+
+def build_faiss_index(
+    chunks_df: pd.DataFrame,
+    model_name: str = "BAAI/bge-small-en-v1.5",
+    use_flat: bool = False
+):
     """
     Create embeddings and build FAISS index from unified chunks.
     
     Args:
         chunks_df: DataFrame with chunk_text column
         model_name: SentenceTransformer model to use
+        use_flat: Build an exact IndexFlatL2 instead of HNSW (for validating recall)
+    
+    HNSW vectors are stored as FP16 scalar-quantized codes. Set
+    DOCTORBOT_FP32_INDEX=1 to keep full FP32 vectors for comparison.
     
     Returns:
         tuple: (faiss_index, embeddings_array, model)
@@ -22,11 +78,15 @@ def build_faiss_index(chunks_df: pd.DataFrame, model_name: str = "BAAI/bge-small
     print("="*70)
     
     print(f"\n🤖 Loading embedding model: {model_name}")
-    model = SentenceTransformer(model_name)
+    device = select_device()
+    model = load_embedding_model(model_name, device=device)
+    if device == 'cuda' and not is_onnx_model(model):
+        # FP16 on GPU roughly doubles throughput with no measurable recall loss
+        model.half()
+    print(f"   ✓ Using device: {device} ({'onnx' if is_onnx_model(model) else 'torch'})")
     
     # Get embedding dimension
-    sample_embedding = model.encode("test")
-    embedding_dim = len(sample_embedding)
+    embedding_dim = model.get_sentence_embedding_dimension()
     print(f"   ✓ Embedding dimension: {embedding_dim}")
     
     # Encode all chunks with progress bar
@@ -38,25 +98,91 @@ def build_faiss_index(chunks_df: pd.DataFrame, model_name: str = "BAAI/bge-small
     
     # Batch encode for efficiency
     print(f"\n⚙️  Encoding (this may take a few minutes)...")
-    embeddings = model.encode(
-        texts,
-        show_progress_bar=True,
-        batch_size=32,
-        convert_to_numpy=True
-    )
+    batch_size = 32 if device == 'cpu' else 256
+    if device == 'cuda' and torch.cuda.device_count() > 1:
+        # Spread encoding over every visible GPU
+        pool = model.start_multi_process_pool()
+        try:
+            embeddings = model.encode_multi_process(
+                texts, pool, batch_size=batch_size, normalize_embeddings=True
+            )
+        finally:
+            model.stop_multi_process_pool(pool)
+    else:
+        embeddings = _encode_length_bucketed(model, texts, batch_size)
     
     print(f"\n✓ Created embeddings with shape: {embeddings.shape}")
     
+    embeddings = embeddings.astype('float32')
+    
     # Build FAISS index
     print(f"\n🔍 Building FAISS index...")
-    index = faiss.IndexFlatL2(embedding_dim)  # L2 distance
-    index.add(embeddings.astype('float32'))
+    if use_flat:
+        # Exact brute-force search, kept as the reference for recall checks
+        index = faiss.IndexFlatL2(embedding_dim)  # L2 distance
+        index.add(embeddings)
+    else:
+        # HNSW graph over normalized vectors: inner product == cosine similarity
+        faiss.normalize_L2(embeddings)
+        if os.getenv('DOCTORBOT_FP32_INDEX'):
+            index = faiss.IndexHNSWFlat(embedding_dim, 32, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # FP16 codes halve index RAM and bytes scanned per query
+            index = faiss.IndexHNSWSQ(
+                embedding_dim, faiss.ScalarQuantizer.QT_fp16, 32, faiss.METRIC_INNER_PRODUCT
+            )
+        index.hnsw.efConstruction = 200
+        index.train(embeddings)
+        index.add(embeddings)
+        index.hnsw.efSearch = 64
     
-    print(f"✓ FAISS index built with {index.ntotal} vectors")
+    print(f"✓ FAISS index built with {index.ntotal} vectors ({type(index).__name__})")
     
     return index, embeddings, model
 
 
+def deduplicate_chunks(chunks_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drop chunks whose text is identical to an earlier chunk.
+    
+    Identical texts would produce identical vectors that only take index
+    space and crowd out other neighbours. The first occurrence is kept and
+    records every original chunk_id it stands for in 'merged_chunk_ids'.
+    """
+    hashes = chunks_df['chunk_text'].map(
+        lambda text: hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    )
+    # groupby(sort=False) yields groups in first-seen order, matching ~duplicated()
+    merged_ids = chunks_df.groupby(hashes, sort=False)['chunk_id'].agg(list)
+    
+    unique_df = chunks_df.loc[~hashes.duplicated()].reset_index(drop=True)
+    unique_df['merged_chunk_ids'] = merged_ids.to_numpy()
+    
+    print(f"✓ Removed {len(chunks_df) - len(unique_df)} duplicate chunks "
+          f"({len(unique_df)} unique)")
+    return unique_df
+
+
+def validate_recall(index, embeddings: np.ndarray, top_k: int = 5, num_queries: int = 200) -> float:
+    """
+    Measure recall@k of an index against exact inner-product search.
+    
+    A sample of the (normalized) chunk embeddings is used as queries, so
+    this can be run right after building without a labelled query set.
+    """
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    queries = np.ascontiguousarray(embeddings[sample], dtype='float32')
+    
+    reference = faiss.IndexFlatIP(embeddings.shape[1])
+    reference.add(np.ascontiguousarray(embeddings, dtype='float32'))
+    _, expected = reference.search(queries, top_k)
+    _, found = index.search(queries, top_k)
+    
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / expected.size
+
+
 def save_index_and_metadata(index, embeddings, chunks_df, model):
     """Save FAISS index, embeddings, and metadata."""
     store_dir = Path(__file__).parent.parent / 'store'
@@ -73,12 +199,12 @@ def save_index_and_metadata(index, embeddings, chunks_df, model):
     
     # Save embeddings
     embeddings_path = store_dir / 'embeddings.npy'
-    np.save(embeddings_path, embeddings)
+    np.save(embeddings_path, embeddings.astype(np.float16))
     print(f"✅ Saved embeddings to: {embeddings_path}")
     
     # Save metadata (chunks DataFrame)
-    metadata_path = store_dir / 'chunks_metadata.pkl'
-    chunks_df.to_pickle(metadata_path)
+    metadata_path = store_dir / 'chunks_metadata.parquet'
+    chunks_df.to_parquet(metadata_path, compression='zstd', index=False)
     print(f"✅ Saved metadata to: {metadata_path}")
     
     # Save config
@@ -88,11 +214,32 @@ def save_index_and_metadata(index, embeddings, chunks_df, model):
         'total_chunks': len(chunks_df),
         'medlineplus_chunks': len(chunks_df[chunks_df['source_type']=='medlineplus']),
         'textbook_chunks': len(chunks_df[chunks_df['source_type']=='textbook']),
-        'embedding_dim': embeddings.shape[1]
+        'embedding_dim': embeddings.shape[1],
+        'index_type': (
+            'flat' if isinstance(index, faiss.IndexFlat)
+            else 'hnsw_sq_fp16' if isinstance(index, faiss.IndexHNSWSQ)
+            else 'hnsw'
+        ),
+        'metric': 'l2' if index.metric_type == faiss.METRIC_L2 else 'ip'
     }
     with open(config_path, 'wb') as f:
         pickle.dump(config, f)
     print(f"✅ Saved config to: {config_path}")
+    
+    # Save manifest last so it only ever lists complete artifacts; the
+    # retriever reads it instead of checking each file
+    manifest_path = store_dir / 'manifest.json'
+    manifest = {
+        'version': 2,
+        'files': {
+            'index': index_path.name,
+            'metadata': metadata_path.name,
+            'config': config_path.name
+        }
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ Saved manifest to: {manifest_path}")
 
 
 if __name__ == "__main__":
@@ -106,6 +253,7 @@ if __name__ == "__main__":
     chunks_path = project_root / 'data' / 'chunks_unified.pkl'
     chunks_df = pd.read_pickle(chunks_path)
     print(f"✓ Loaded {len(chunks_df)} chunks")
+    chunks_df = deduplicate_chunks(chunks_df)
     
     # Step 2: Build index
     print(f"\n{'='*70}")
@@ -113,6 +261,10 @@ if __name__ == "__main__":
     print(f"{'='*70}")
     index, embeddings, model = build_faiss_index(chunks_df)
     
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        recall = validate_recall(index, embeddings)
+        print(f"✓ Recall@5 vs exact search: {recall:.3f}")
+    
     # Step 3: Save everything
     print(f"\n{'='*70}")
     print("STEP 3: Saving index and metadata")
@@ -1,8 +1,19 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from typing import List
 from pathlib import Path
 import re
 
+# Chunk size and overlap in words for each source type. The textbook gets
+# larger chunks for its detailed clinical content; MedlinePlus summaries
+# are concise. unified_data_loader pre-splits the textbook with the same
+# settings, so its sections pass through as single chunks
+TEXTBOOK_CHUNK_WORDS = 600
+TEXTBOOK_CHUNK_OVERLAP = 150
+MEDLINE_CHUNK_WORDS = 400
+MEDLINE_CHUNK_OVERLAP = 50
+
 def chunk_text_with_overlap(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
     """
     Split text into overlapping chunks by words, respecting sentence boundaries.
@@ -18,40 +29,37 @@ def chunk_text_with_overlap(text: str, chunk_size: int = 500, overlap: int = 100
     # Split into sentences (basic sentence splitting)
     sentences = re.split(r'(?<=[.!?])\s+', text)
     
+    # Count words once per sentence; a chunk is always a contiguous run of
+    # sentences, so it is tracked as a start index plus a running word count
+    word_counts = [len(sentence.split()) for sentence in sentences]
+    
     chunks = []
-    current_chunk = []
+    chunk_start = 0
     current_word_count = 0
     
-    for sentence in sentences:
-        sentence_words = sentence.split()
-        sentence_word_count = len(sentence_words)
-        
+    for i, sentence_word_count in enumerate(word_counts):
         # If adding this sentence would exceed chunk_size
-        if current_word_count + sentence_word_count > chunk_size and current_chunk:
+        if current_word_count + sentence_word_count > chunk_size and i > chunk_start:
             # Save current chunk
-            chunks.append(' '.join(current_chunk))
+            chunks.append(' '.join(sentences[chunk_start:i]))
             
-            # Start new chunk with overlap
-            # Calculate how many words to overlap
-            overlap_words = []
+            # Start new chunk with overlap: walk back over whole sentences
+            # while they still fit in the overlap budget
+            overlap_start = i
             overlap_count = 0
-            for sent in reversed(current_chunk):
-                sent_words = sent.split() if isinstance(sent, str) else []
-                if overlap_count + len(sent_words) <= overlap:
-                    overlap_words.insert(0, sent)
-                    overlap_count += len(sent_words)
-                else:
-                    break
+            while (overlap_start > chunk_start
+                   and overlap_count + word_counts[overlap_start - 1] <= overlap):
+                overlap_start -= 1
+                overlap_count += word_counts[overlap_start]
             
-            current_chunk = overlap_words + [sentence]
-            current_word_count = sum(len(s.split()) for s in current_chunk)
+            chunk_start = overlap_start
+            current_word_count = overlap_count + sentence_word_count
         else:
-            current_chunk.append(sentence)
             current_word_count += sentence_word_count
     
     # Add the last chunk
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
+    if chunk_start < len(sentences):
+        chunks.append(' '.join(sentences[chunk_start:]))
     
     return chunks
 
@@ -68,36 +76,50 @@ def create_chunks_from_unified_data(csv_path: Path) -> pd.DataFrame:
     print("CREATING CHUNKS FROM UNIFIED DATASET")
     print("="*70)
     
-    df = pd.read_csv(csv_path)
+    # Arrow CSV parser. Summaries are multi-line fields, and CSVs written
+    # before the textbook was split hold it as one multi-MB field, so
+    # blocks must be large enough to hold it whole; ids mix numbers with
+    # 'textbook_*' strings.
+    df = pacsv.read_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(block_size=32 << 20),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(column_types={'id': pa.string()})
+    ).to_pandas()
+    
+    # Build full text with context for every document in one vectorized pass.
+    # A missing value would turn the whole concatenated row into NaN
+    title = df['title'].fillna('')
+    also_called = df['also_called'].fillna('')
+    summary = df['summary'].fillna('')
+    df['full_text'] = (
+        title + '. '
+        + ('Also known as: ' + also_called + '. ').where(also_called != '', '')
+        + summary
+    )
+    
+    textbook_docs = int((df['source_type'] == 'textbook').sum())
+    print(f"   {len(df) - textbook_docs} MedlinePlus documents, {textbook_docs} textbook documents")
     
     all_chunks = []
     chunk_id = 0
     
-    for idx, row in df.iterrows():
+    columns = ['title', 'full_text', 'source_type', 'id', 'url']
+    rows = df[columns].itertuples(index=False, name=None)
+    
+    for idx, (title, full_text, source_type, source_id, url) in enumerate(rows):
         if (idx + 1) % 100 == 0:
             print(f"   Processing document {idx + 1}/{len(df)}...")
         
-        title = row['title']
-        summary = row['summary']
-        source_type = row['source_type']
-        also_called = row['also_called'] if pd.notna(row['also_called']) else ''
-        
-        # Build full text with context
-        full_text = f"{title}. "
-        if also_called:
-            full_text += f"Also known as: {also_called}. "
-        full_text += summary
-        
         # Different chunking strategy based on source
         if source_type == 'textbook':
             # Larger chunks for detailed clinical content
-            chunk_size = 600
-            overlap = 150
-            print(f"\n📖 Chunking textbook content...")
+            chunk_size = TEXTBOOK_CHUNK_WORDS
+            overlap = TEXTBOOK_CHUNK_OVERLAP
         else:
             # Smaller chunks for concise MedlinePlus summaries
-            chunk_size = 400
-            overlap = 50
+            chunk_size = MEDLINE_CHUNK_WORDS
+            overlap = MEDLINE_CHUNK_OVERLAP
         
         # Create chunks
         chunks = chunk_text_with_overlap(full_text, chunk_size, overlap)
@@ -107,8 +129,8 @@ def create_chunks_from_unified_data(csv_path: Path) -> pd.DataFrame:
                 'chunk_id': chunk_id,
                 'title': title,
                 'chunk_text': chunk_text,
-                'source_id': row['id'],
-                'url': row['url'],
+                'source_id': source_id,
+                'url': url,
                 'source_type': source_type
             })
             chunk_id += 1
@@ -1,19 +1,22 @@
-import xml.etree.ElementTree as ET
-import html
-import re
 import pandas as pd
 from pathlib import Path
+from lxml import etree
+from lxml import html as lhtml
 
 
 def clean_html_text(html_text):
     """Remove HTML tags and clean text."""
-    # Decode HTML entities (e.g., &lt; to <)
-    text = html.unescape(html_text)
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', ' ', text)
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    # Parse the fragment in C; entities are decoded by the parser
+    fragment = lhtml.fragment_fromstring(html_text, create_parent='div')
+    # Tag boundaries become spaces, then whitespace is collapsed
+    return ' '.join(' '.join(fragment.itertext()).split())
+
+
+def _release(element):
+    """Free a parsed element and any already-processed siblings before it."""
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
 
 
 def parse_medlineplus_xml(xml_path):
@@ -23,14 +26,13 @@ def parse_medlineplus_xml(xml_path):
     Returns:
         pd.DataFrame with columns: title, also_called, summary, url, id
     """
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    
     topics = []
     
-    for health_topic in root.findall('health-topic'):
+    # Stream topics one at a time instead of holding the whole DOM in memory
+    for _, health_topic in etree.iterparse(str(xml_path), events=('end',), tag='health-topic'):
         language = health_topic.get('language', '')
         if language != 'English':
+            _release(health_topic)
             continue
         # Extract basic info
         title = health_topic.get('title', '')
@@ -48,6 +50,8 @@ def parse_medlineplus_xml(xml_path):
         else:
             summary = ''
         
+        _release(health_topic)
+        
         # Skip if no meaningful content
         if not summary or len(summary) < 50:
             continue
@@ -0,0 +1,46 @@
+import os
+import torch
+from sentence_transformers import SentenceTransformer
+
+
+def select_device() -> str:
+    """Pick the fastest available torch device for encoding."""
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def load_embedding_model(model_name: str, device: str = None) -> SentenceTransformer:
+    """
+    Load the embedding model on the configured inference backend.
+
+    DOCTORBOT_EMBED_BACKEND selects 'torch' (default) or 'onnx'. The ONNX
+    backend runs through ONNX Runtime with the same pooling and
+    normalization as the PyTorch model, so embeddings are interchangeable.
+    Set DOCTORBOT_ONNX_FILE to pick a specific export inside the model
+    repo, e.g. 'onnx/model_qint8_avx512_vnni.onnx' for int8 on CPU.
+
+    Args:
+        model_name: SentenceTransformer model to load
+        device: torch device the model will run on
+
+    Returns:
+        SentenceTransformer: Model ready for encode()
+    """
+    backend = os.environ.get('DOCTORBOT_EMBED_BACKEND', 'torch')
+    if backend != 'onnx':
+        return SentenceTransformer(model_name, device=device)
+
+    provider = 'CUDAExecutionProvider' if device == 'cuda' else 'CPUExecutionProvider'
+    model_kwargs = {'provider': provider}
+    onnx_file = os.environ.get('DOCTORBOT_ONNX_FILE')
+    if onnx_file:
+        model_kwargs['file_name'] = onnx_file
+    return SentenceTransformer(model_name, device=device, backend='onnx', model_kwargs=model_kwargs)
+
+
+def is_onnx_model(model: SentenceTransformer) -> bool:
+    """True when the model runs on ONNX Runtime instead of torch."""
+    return getattr(model, 'backend', 'torch') == 'onnx'
@@ -1,6 +1,33 @@
 from typing import Dict, List
 import re
 
+try:
+    import ahocorasick
+except ImportError:  # fall back to a single compiled regex
+    ahocorasick = None
+
+
+def _build_matcher(keywords):
+    """
+    Build a single multi-keyword matcher.
+    
+    Uses an Aho-Corasick automaton when pyahocorasick is installed,
+    otherwise one precompiled regex alternation of every keyword.
+    """
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for keyword in keywords:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        return automaton
+    
+    # Zero-width lookahead so overlapping keywords are all reported;
+    # longest first so a keyword wins over any shorter prefix of it
+    alternation = '|'.join(
+        re.escape(kw) for kw in sorted(keywords, key=len, reverse=True)
+    )
+    return re.compile(f'(?=({alternation}))')
+
 
 class EmergencyDetector:
     """Detects emergency symptoms that require immediate medical attention."""
@@ -47,6 +74,23 @@ class EmergencyDetector:
         ]
     }
     
+    # keyword -> (category order, keyword order, category, keyword), built
+    # once at class load so instances share it
+    _KEYWORD_INFO = {
+        keyword: (category_rank, keyword_rank, category, keyword)
+        for category_rank, (category, keywords) in enumerate(EMERGENCY_KEYWORDS.items())
+        for keyword_rank, keyword in enumerate(keywords)
+    }
+    
+    # Multi-keyword matcher shared by every instance
+    _MATCHER = _build_matcher(_KEYWORD_INFO)
+    
+    def _find_keywords(self, text_lower: str) -> set:
+        """Return every keyword that occurs in the lowered text."""
+        if isinstance(self._MATCHER, re.Pattern):
+            return {match.group(1) for match in self._MATCHER.finditer(text_lower)}
+        return {keyword for _, keyword in self._MATCHER.iter(text_lower)}
+    
     def detect(self, text: str) -> Dict:
         """
         Detect if symptoms indicate an emergency.
@@ -62,13 +106,16 @@ class EmergencyDetector:
         detected_categories = []
         matched_keywords = []
         
-        # Check each category
-        for category, keywords in self.EMERGENCY_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    detected_categories.append(category)
-                    matched_keywords.append(keyword)
-                    break  # One match per category is enough
+        # One linear pass finds every keyword occurrence
+        found = self._find_keywords(text_lower)
+        
+        # Report the first listed keyword per category, in category order;
+        # sorting only the hits keeps this independent of keyword count
+        for _, _, category, keyword in sorted(self._KEYWORD_INFO[kw] for kw in found):
+            if detected_categories and detected_categories[-1] == category:
+                continue  # One match per category is enough
+            detected_categories.append(category)
+            matched_keywords.append(keyword)
         
         is_emergency = len(detected_categories) > 0
         
@@ -1,34 +1,67 @@
 import fitz  # PyMuPDF
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import json
 import re
 
+
+# Cleaning patterns, compiled once at import
+_PAGE_NUMBER_RE = re.compile(r'\n\s*\d+\s*\n')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+_MULTI_SPACE_RE = re.compile(r' {2,}')
+_BOOK_HEADER_RE = re.compile(r'Symptom to Diagnosis.*?Edition', re.IGNORECASE)
+_BULLET_RE = re.compile(r'^\s*[•●○]\s*', re.MULTILINE)
+
+
+# Plain-text extraction without image blocks; ligatures are expanded to
+# their letters so the later ASCII filter does not drop them
+_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES & ~fitz.TEXT_PRESERVE_LIGATURES
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> list:
+    """Extract text for pages [start, end) in a worker process."""
+    # Malformed pages are common in scanned books; don't spend I/O reporting them
+    fitz.TOOLS.mupdf_display_errors(False)
+    doc = fitz.open(pdf_path)
+    pages = [doc[page_num].get_text("text", flags=_TEXT_FLAGS) for page_num in range(start, end)]
+    doc.close()
+    return pages
+
+
 def extract_all_text_from_pdf(pdf_path: Path) -> str:
     """
     Extract ALL text from the textbook as one continuous document.
     We'll chunk it intelligently later.
+    
+    Pages are split into contiguous ranges and decoded in parallel worker
+    processes. MuPDF is not thread-safe, so each worker opens its own
+    document handle rather than sharing one across threads.
     """
     print(f"📖 Opening PDF: {pdf_path}")
     doc = fitz.open(pdf_path)
-    
     total_pages = len(doc)
+    doc.close()
     print(f"📄 Total pages: {total_pages}")
     
+    workers = min(os.cpu_count() or 1, max(total_pages, 1))
+    step = max(1, -(-total_pages // workers))  # ceiling division
+    ranges = [(start, min(start + step, total_pages)) for start in range(0, total_pages, step)]
+    print(f"   Extracting with {len(ranges)} worker processes...")
+    
     all_text = []
     
-    for page_num in range(total_pages):
-        if page_num % 50 == 0:
-            print(f"   Extracting page {page_num + 1}/{total_pages}...")
-        
-        page = doc[page_num]
-        text = page.get_text()
-        
-        # Skip completely empty pages
-        if text.strip():
-            all_text.append(text)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_extract_page_range, str(pdf_path), start, end)
+            for start, end in ranges
+        ]
+        # Collect in submission order so pages stay in book order
+        for future in futures:
+            # Skip completely empty pages
+            all_text.extend(text for text in future.result() if text.strip())
     
     full_text = '\n\n'.join(all_text)
-    doc.close()
     
     print(f"✓ Extracted {len(full_text):,} characters from {total_pages} pages")
     
@@ -38,22 +71,20 @@ def extract_all_text_from_pdf(pdf_path: Path) -> str:
 def clean_textbook_text(text: str) -> str:
     """Clean extracted text."""
     # Remove page numbers (standalone numbers on their own line)
-    text = re.sub(r'\n\s*\d+\s*\n', '\n', text)
+    text = _PAGE_NUMBER_RE.sub('\n', text)
     
     # Fix common OCR errors
     text = text.replace('w ', '')  # Remove stray 'w' characters
-    text = text.replace('I ', 'I ')
-    text = text.replace('l ', 'l ')
     
     # Remove excessive whitespace
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-    text = re.sub(r' {2,}', ' ', text)
+    text = _BLANK_LINES_RE.sub('\n\n', text)
+    text = _MULTI_SPACE_RE.sub(' ', text)
     
     # Remove headers/footers with book title
-    text = re.sub(r'Symptom to Diagnosis.*?Edition', '', text, flags=re.IGNORECASE)
+    text = _BOOK_HEADER_RE.sub('', text)
     
     # Fix bullet points
-    text = re.sub(r'^\s*[•●○]\s*', '- ', text, flags=re.MULTILINE)
+    text = _BULLET_RE.sub('- ', text)
     
     # Remove non-ASCII but keep medical symbols
     text = text.encode('ascii', 'ignore').decode('ascii')
@@ -1,30 +1,63 @@
-import os
+import asyncio
+import re
 import sys
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
+import orjson
+from openai import OpenAI, AsyncOpenAI
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from rag.prompts import create_followup_prompt
+from rag.openai_client import get_client, get_async_client, run_sync
+from rag.prompts import (
+    create_followup_prompt,
+    create_all_followups_prompt,
+    with_user_message,
+    FOLLOW_UP_MESSAGES,
+    ALL_FOLLOW_UPS_MESSAGES
+)
 
 load_dotenv()
+
+# "A) ...", "B. ...", "C] ..." option lines and the "Question: ..." line,
+# matched against already-stripped lines
+_OPTION_RE = re.compile(r"([A-D])[\)\.\]]\s*(.+)")
+_QUESTION_RE = re.compile(r"Question:\s*(.+)")
+
+
 class FollowUpManager:
     """Manages follow-up questions for symptom screening."""
     
-    def __init__(self):
-        """Initialize with OpenAI client."""
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found")
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, client: Optional[OpenAI] = None, aclient: Optional[AsyncOpenAI] = None):
+        """
+        Initialize with sync and async OpenAI clients.
+        
+        Args:
+            client: OpenAI client to use (defaults to the shared one)
+            aclient: AsyncOpenAI client to use (defaults to the shared one)
+        """
+        self.client = client or get_client()
+        self.aclient = aclient or get_async_client()
+    
+    def _followup_messages(
+        self,
+        conversation_history: List[Dict[str, str]],
+        question_num: int,
+        symptoms_summary: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for one follow-up question."""
+        return with_user_message(
+            FOLLOW_UP_MESSAGES,
+            create_followup_prompt(conversation_history, question_num, symptoms_summary)
+        )
     
     def generate_followup_question(
         self, 
         conversation_history: List[Dict[str, str]], 
-        question_num: int
+        question_num: int,
+        symptoms_summary: Optional[str] = None
     ) -> str:
         """
         Generate a single follow-up question.
@@ -32,22 +65,18 @@ class FollowUpManager:
         Args:
             conversation_history: List of messages so far
             question_num: Which question number (1-4)
+            symptoms_summary: Running summary of the patient's messages (optional)
         
         Returns:
             Generated question text
         """
         print(f"🤔 Generating follow-up question #{question_num}...")
         
-        prompt = create_followup_prompt(conversation_history, question_num)
-        
         response = self.client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a medical assistant asking diagnostic questions."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=self._followup_messages(conversation_history, question_num, symptoms_summary),
             temperature=0.7,
-            max_tokens=200
+            max_tokens=120
         )
         
         question = response.choices[0].message.content.strip()
@@ -55,6 +84,137 @@ class FollowUpManager:
         
         return question
     
+    async def agenerate_followup_question(
+        self,
+        conversation_history: List[Dict[str, str]],
+        question_num: int,
+        symptoms_summary: Optional[str] = None
+    ) -> str:
+        """
+        Async version of generate_followup_question.
+        
+        Args:
+            conversation_history: List of messages so far
+            question_num: Which question number (1-4)
+            symptoms_summary: Running summary of the patient's messages (optional)
+        
+        Returns:
+            Generated question text
+        """
+        print(f"🤔 Generating follow-up question #{question_num}...")
+        
+        response = await self.aclient.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._followup_messages(conversation_history, question_num, symptoms_summary),
+            temperature=0.7,
+            max_tokens=120
+        )
+        
+        question = response.choices[0].message.content.strip()
+        print(f"✓ Generated question #{question_num}")
+        
+        return question
+    
+    def _all_followups_request(self, symptoms_summary: str, num_questions: int) -> Dict:
+        """Chat completion parameters for planning every follow-up at once."""
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": with_user_message(
+                ALL_FOLLOW_UPS_MESSAGES,
+                create_all_followups_prompt(symptoms_summary, num_questions)
+            ),
+            "temperature": 0.7,
+            "max_tokens": 120 * num_questions,
+            "response_format": {"type": "json_object"}
+        }
+    
+    def _parse_all_followups(self, content: str, num_questions: int) -> List[str]:
+        """
+        Convert the JSON question plan to "Question: / A) ..." texts.
+        
+        Malformed entries are skipped, so the result may hold fewer than
+        num_questions questions; a reply without a "questions" list gives [].
+        """
+        try:
+            payload = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            payload = None
+        
+        planned = payload.get('questions') if isinstance(payload, dict) else None
+        if not isinstance(planned, list):
+            print(f"   ⚠️ Could not parse follow-up question plan")
+            return []
+        
+        questions = []
+        for item in planned[:num_questions]:
+            if not isinstance(item, dict) or not item.get('question'):
+                continue
+            # A string would otherwise be zipped into one option per character
+            if not isinstance(item.get('options', []), list):
+                continue
+            lines = [f"Question: {str(item['question']).strip()}"]
+            lines += [
+                f"{letter}) {str(option).strip()}"
+                for letter, option in zip("ABCD", item.get('options', []))
+            ]
+            questions.append("\n".join(lines))
+        
+        print(f"✓ Generated {len(questions)} follow-up questions")
+        return questions
+    
+    def generate_all_followups(self, symptoms_summary: str, num_questions: int = 3) -> List[str]:
+        """
+        Generate every follow-up question for a conversation in one call.
+        
+        Args:
+            symptoms_summary: The patient's initial symptom description
+            num_questions: How many questions to plan
+        
+        Returns:
+            Question texts in the same format as generate_followup_question
+        """
+        print(f"🤔 Generating {num_questions} follow-up questions in one call...")
+        
+        response = self.client.chat.completions.create(
+            **self._all_followups_request(symptoms_summary, num_questions)
+        )
+        return self._parse_all_followups(response.choices[0].message.content, num_questions)
+    
+    async def agenerate_all_followups(self, symptoms_summary: str, num_questions: int = 3) -> List[str]:
+        """Async version of generate_all_followups."""
+        print(f"🤔 Generating {num_questions} follow-up questions in one call...")
+        
+        response = await self.aclient.chat.completions.create(
+            **self._all_followups_request(symptoms_summary, num_questions)
+        )
+        return self._parse_all_followups(response.choices[0].message.content, num_questions)
+    
+    async def agenerate_followup_questions(
+        self,
+        requests: List[Tuple[List[Dict[str, str]], int]],
+        max_concurrency: int = 10
+    ) -> List[str]:
+        """
+        Generate several follow-up questions concurrently.
+        
+        Args:
+            requests: (conversation_history, question_num) pairs
+            max_concurrency: Maximum API calls in flight at once
+        
+        Returns:
+            Generated question texts, in the same order as requests
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def generate(conversation_history, question_num):
+            async with semaphore:
+                return await self.agenerate_followup_question(conversation_history, question_num)
+        
+        return await asyncio.gather(*(
+            generate(conversation_history, question_num)
+            for conversation_history, question_num in requests
+        ))
+    
     def parse_question_options(self, question_text: str) -> Dict:
         """
         Parse the question to extract options if present.
@@ -62,19 +222,16 @@ class FollowUpManager:
         Returns:
             Dict with 'question' and 'options' (if multiple choice)
         """
-        lines = question_text.strip().split('\n')
-        
-        # Find the question line
         question = ""
         options = []
         
+        # Strip each line once and skip blanks; splitlines also handles \r\n
+        lines = filter(None, (line.strip() for line in question_text.splitlines()))
         for line in lines:
-            line = line.strip()
-            if line.startswith("Question:"):
-                question = line.replace("Question:", "").strip()
-            elif line and (line[0] in ['A', 'B', 'C', 'D'] and line[1] in [')', '.', ']']):
-                # This is an option
+            if _OPTION_RE.match(line):
                 options.append(line)
+            elif (match := _QUESTION_RE.match(line)):
+                question = match.group(1)
         
         return {
             'question': question if question else question_text,
@@ -91,17 +248,25 @@ if __name__ == "__main__":
     
     manager = FollowUpManager()
     
-    # Test conversation
+    # Test conversation - answers are simulated, so every history is known
+    # up front and all questions can be generated concurrently
     test_history = [
         {"role": "user", "content": "I have chest pain and shortness of breath"}
     ]
     
+    histories = []
     for i in range(1, 4):
+        histories.append((list(test_history), i))
+        test_history.append({"role": "assistant", "content": f"Follow-up question {i}"})
+        test_history.append({"role": "user", "content": f"Test answer for question {i}"})
+    
+    questions = run_sync(manager.agenerate_followup_questions(histories))
+    
+    for i, question in enumerate(questions, 1):
         print(f"\n{'='*70}")
-        print(f"GENERATING QUESTION {i}")
+        print(f"QUESTION {i}")
         print(f"{'='*70}")
         
-        question = manager.generate_followup_question(test_history, i)
         parsed = manager.parse_question_options(question)
         
         print(f"\n📋 Question: {parsed['question']}")
@@ -110,12 +275,8 @@ if __name__ == "__main__":
             for opt in parsed['options']:
                 print(f"   {opt}")
         
-        # Simulate user answer
         if i < 3:
-            test_answer = f"Test answer for question {i}"
-            test_history.append({"role": "assistant", "content": question})
-            test_history.append({"role": "user", "content": test_answer})
-            print(f"\n💬 Simulated answer: {test_answer}")
+            print(f"\n💬 Simulated answer: Test answer for question {i}")
     
     print(f"\n{'='*70}")
     print("✅ Follow-up question generation test complete!")
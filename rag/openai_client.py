@@ -0,0 +1,50 @@
+import asyncio
+import os
+import threading
+from functools import lru_cache
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+load_dotenv()
+
+# One pool per process; keep-alive connections skip the TLS handshake
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+
+def _api_key() -> str:
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    return api_key
+
+
+@lru_cache(maxsize=1)
+def get_client() -> OpenAI:
+    """Shared OpenAI client used by the pipeline and follow-up manager."""
+    return OpenAI(api_key=_api_key(), http_client=DefaultHttpxClient(limits=HTTP_LIMITS))
+
+
+@lru_cache(maxsize=1)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Background event loop that runs every call made on the async client."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='openai-event-loop', daemon=True).start()
+    return loop
+
+
+@lru_cache(maxsize=1)
+def get_async_client() -> AsyncOpenAI:
+    """
+    Shared AsyncOpenAI client.
+
+    Pooled connections belong to the event loop that opened them, so
+    coroutines using this client should run on get_event_loop(), e.g.
+    through run_sync().
+    """
+    return AsyncOpenAI(api_key=_api_key(), http_client=DefaultAsyncHttpxClient(limits=HTTP_LIMITS))
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared event loop and block for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
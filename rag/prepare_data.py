@@ -1,28 +1,43 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from pathlib import Path
 from data_loader import parse_medlineplus_xml
 
 
 def prepare_medline_data():
     """
-    Parse XML and save cleaned data to CSV.
+    Parse XML and save cleaned data to Parquet.
     """
     # Paths
     project_root = Path(__file__).parent.parent
     xml_path = project_root / 'data' / 'medplus.xml'
-    output_csv = project_root / 'data' / 'medline_cleaned.csv'
+    output_path = project_root / 'data' / 'medline_cleaned.parquet'
     
     print("📚 Parsing MedlinePlus XML...")
     df = parse_medlineplus_xml(xml_path)
     
+    # One Arrow conversion serves both the statistics and the Parquet write
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    
+    # pc.mean and pc.sum return null for an empty or all-null column, and an
+    # all-None column converts to Arrow's null type, hence the casts
+    avg_summary = alt_names = 0
+    if table.num_rows:
+        summaries = table['summary'].cast(pa.string())
+        also_called = table['also_called'].cast(pa.string())
+        avg_summary = pc.mean(pc.utf8_length(summaries)).as_py() or 0
+        alt_names = pc.sum(pc.not_equal(also_called, '')).as_py() or 0
+    
     print(f"\n📊 Data Statistics:")
-    print(f"   Total topics: {len(df)}")
-    print(f"   Avg summary length: {df['summary'].str.len().mean():.0f} characters")
-    print(f"   Topics with alt names: {(df['also_called'] != '').sum()}")
+    print(f"   Total topics: {table.num_rows}")
+    print(f"   Avg summary length: {avg_summary:.0f} characters")
+    print(f"   Topics with alt names: {alt_names}")
     
-    # Save to CSV
-    df.to_csv(output_csv, index=False)
-    print(f"\n✅ Saved cleaned data to: {output_csv}")
+    # Save to Parquet - keeps dtypes and loads far faster than CSV
+    pq.write_table(table, output_path, compression='snappy')
+    print(f"\n✅ Saved cleaned data to: {output_path}")
     
     # Show sample
     print(f"\n📋 Sample entries:")
@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 
 FOLLOW_UP_SYSTEM_PROMPT = """You are a medical assistant helping to gather information about a patient's symptoms. 
@@ -19,7 +19,19 @@ B) [Option 2]
 C) [Option 3]
 D) [Option 4 - if needed]
 
-EACH OPTION MUST BE ON ITS OWN LINE. Do not put options on the same line."""
+EACH OPTION MUST BE ON ITS OWN LINE. Do not put options on the same line.
+
+IMPORTANT: 
+- Do NOT repeat questions already asked
+- Build upon previous answers
+- Focus on NEW aspects that help narrow down the diagnosis
+
+EXAMPLE of correct format:
+Question: How severe is your fever?
+A) Mild (under 100°F)
+B) Moderate (100-102°F)
+C) High (102-104°F)
+D) Very high (above 104°F)"""
 
 
 DIAGNOSIS_SYSTEM_PROMPT = """You are a knowledgeable medical AI assistant with access to TWO authoritative sources:
@@ -41,13 +53,125 @@ OUTPUT STRUCTURE (must include all sections):
 2. **30/60/90-Day Outlook**: Expected progression over time
 3. **Lifestyle Recommendations**: Evidence-based self-care tips
 4. **Red Flags & Next Steps**: Warning signs requiring immediate attention
-5. **Citations**: Reference both textbook and MedlinePlus sources used"""
+5. **Citations**: Reference both textbook and MedlinePlus sources used
+
+Cite appropriately (e.g., "According to the Symptom to Diagnosis textbook..." or "MedlinePlus indicates..."), maintain a caring, professional tone, and focus on information actually present in the retrieved context.
+
+Format your response with these sections:
+
+## Likely Condition
+[Explain what the patient might be experiencing. Use clinical reasoning from the textbook AND patient-friendly language from MedlinePlus. Cite both sources when possible.]
+
+## Expected Progression (30/60/90 Days)
+- **30 days**: [What to expect in the first month]
+- **60 days**: [What to expect after two months]
+- **90 days**: [Long-term outlook]
+
+## Lifestyle Recommendations
+[Provide practical, evidence-based self-care advice from both sources]
+
+## Red Flags & Next Steps
+[List warning signs that require immediate medical attention. Be specific and cite sources.]
+
+## Citations
+- Textbook sources: [List relevant textbook sections referenced]
+- MedlinePlus sources: [List relevant MedlinePlus topics referenced]
+
+## Important Disclaimer
+This AI assessment is for informational purposes only and is not a substitute for professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment."""
+
+
+FALLBACK_DIAGNOSIS_SYSTEM_PROMPT = """You are a knowledgeable medical AI assistant.
+
+Provide a medical assessment of the patient's symptoms using your general medical knowledge. Include:
+
+## Likely Condition
+[Explain possible conditions based on the symptoms]
+
+## Expected Progression (30/60/90 Days)
+- **30 days**: [Short-term outlook]
+- **60 days**: [Medium-term outlook]
+- **90 days**: [Long-term outlook]
+
+## Lifestyle Recommendations
+[Self-care and lifestyle advice]
+
+## Red Flags & Next Steps
+[Warning signs requiring immediate medical attention]
+
+## Important Note
+⚠️ **Note**: This response is based on general medical knowledge as specific reference materials did not contain directly relevant information for your symptoms. For accurate diagnosis and treatment, please consult a healthcare provider.
+
+## Important Disclaimer
+This AI assessment is for informational purposes only and is not a substitute for professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment."""
+
+
+ALL_FOLLOW_UPS_SYSTEM_PROMPT = """You are a medical assistant helping to gather information about a patient's symptoms.
+Your role is to plan a short screening interview: a set of multiple choice follow-up questions asked one after another.
+
+Guidelines:
+- Ask questions that help narrow down the diagnosis
+- Cover different aspects, e.g. severity, duration, associated symptoms, and risk factors
+- Never ask the same thing twice
+- Provide 3-4 clear multiple choice options per question
+- Keep questions clear and concise
+- Be empathetic and professional
+
+Respond with ONLY a JSON object of this form:
+{"questions": [{"question": "How severe is your fever?", "options": ["Mild (under 100°F)", "Moderate (100-102°F)", "High (102-104°F)", "Very high (above 104°F)"]}]}"""
+
 
+MEDICAL_TRIAGE_JSON_INSTRUCTIONS = """Before answering, decide whether the patient's input is related to health, medical symptoms, diseases, or healthcare.
+Questions like "I have a headache" or "What causes diabetes?" are medical; "What is the use of a pen?" or "Tell me a joke" are not.
 
-def create_followup_prompt(conversation_history: List[Dict[str, str]], question_num: int) -> str:
-    """Create prompt for generating multiple choice follow-up questions."""
-    user_messages = [msg['content'] for msg in conversation_history if msg['role'] == 'user']
-    symptoms_summary = " | ".join(user_messages)
+Respond with ONLY a JSON object with these keys:
+- "is_medical": true or false
+- "rejection_reason": short reason when is_medical is false, otherwise ""
+- "diagnosis": the full markdown assessment when is_medical is true, otherwise an empty string"""
+
+
+# Static system messages, built once. Requests are assembled as one of these
+# prefixes plus a single dynamic user message (see with_user_message).
+FOLLOW_UP_MESSAGES = ({"role": "system", "content": FOLLOW_UP_SYSTEM_PROMPT},)
+ALL_FOLLOW_UPS_MESSAGES = ({"role": "system", "content": ALL_FOLLOW_UPS_SYSTEM_PROMPT},)
+
+DIAGNOSIS_MESSAGES = ({"role": "system", "content": DIAGNOSIS_SYSTEM_PROMPT},)
+DIAGNOSIS_TRIAGE_MESSAGES = (
+    {"role": "system", "content": f"{DIAGNOSIS_SYSTEM_PROMPT}\n\n{MEDICAL_TRIAGE_JSON_INSTRUCTIONS}"},
+)
+
+FALLBACK_DIAGNOSIS_MESSAGES = ({"role": "system", "content": FALLBACK_DIAGNOSIS_SYSTEM_PROMPT},)
+FALLBACK_DIAGNOSIS_TRIAGE_MESSAGES = (
+    {"role": "system", "content": f"{FALLBACK_DIAGNOSIS_SYSTEM_PROMPT}\n\n{MEDICAL_TRIAGE_JSON_INSTRUCTIONS}"},
+)
+
+
+def with_user_message(static_messages: tuple, content: str) -> List[Dict[str, str]]:
+    """Append the dynamic user message to a prebuilt static prefix."""
+    return [*static_messages, {"role": "user", "content": content}]
+
+
+def create_followup_prompt(
+    conversation_history: List[Dict[str, str]],
+    question_num: int,
+    symptoms_summary: Optional[str] = None
+) -> str:
+    """
+    Create the user message for a multiple choice follow-up question.
+    
+    Only patient-specific text goes here; the instructions and example live
+    in FOLLOW_UP_SYSTEM_PROMPT so the request prefix stays identical.
+    
+    Args:
+        conversation_history: List of messages so far
+        question_num: Which question number (1-4)
+        symptoms_summary: " | "-joined user messages, if the caller already
+            keeps one; otherwise it is rebuilt from the history
+    """
+    if symptoms_summary is None:
+        symptoms_summary = " | ".join(
+            msg['content'] for msg in conversation_history if msg['role'] == 'user'
+        )
     
     last_qa = ""
     if len(conversation_history) >= 2:
@@ -56,38 +180,20 @@ def create_followup_prompt(conversation_history: List[Dict[str, str]], question_
         if last_q and last_a:
             last_qa = f"\nLast Question Asked: {last_q}\nPatient's Answer: {last_a}\n"
     
-    prompt = f"""{FOLLOW_UP_SYSTEM_PROMPT}
-
-Patient's symptoms so far: {symptoms_summary}
+    prompt = f"""Patient's symptoms so far: {symptoms_summary}
 {last_qa}
 This is follow-up question #{question_num} of 4.
 
-IMPORTANT: 
-- Do NOT repeat questions already asked
-- Build upon previous answers
-- Focus on NEW aspects that help narrow down the diagnosis
-- EACH OPTION MUST BE ON A SEPARATE LINE
-
-Generate ONE NEW multiple choice follow-up question with 3-4 options.
-
-You MUST use this EXACT format (note: each option on its own line):
+Generate ONE NEW multiple choice follow-up question with 3-4 options, EACH OPTION ON A NEW LINE."""
+    
+    return prompt
 
-Question: [Your question]
-A) [First option]
-B) [Second option]
-C) [Third option]
-D) [Fourth option - optional]
 
-EXAMPLE of correct format:
-Question: How severe is your fever?
-A) Mild (under 100°F)
-B) Moderate (100-102°F)
-C) High (102-104°F)
-D) Very high (above 104°F)
+def create_all_followups_prompt(symptoms_summary: str, num_questions: int) -> str:
+    """Create the user message asking for every follow-up question at once."""
+    return f"""Patient's symptoms: {symptoms_summary}
 
-Now generate the question with EACH OPTION ON A NEW LINE:"""
-    
-    return prompt
+Generate {num_questions} distinct multiple choice follow-up questions, in the order they should be asked."""
 
 
 def create_diagnosis_prompt(
@@ -95,53 +201,21 @@ def create_diagnosis_prompt(
     retrieved_context: str
 ) -> str:
     """
-    Create prompt for final diagnosis using both MedlinePlus and textbook sources.
+    Create the user message for the final diagnosis.
+    
+    Holds only the conversation and retrieved context; the instructions and
+    output format live in DIAGNOSIS_SYSTEM_PROMPT.
     """
     history_text = "\n".join([
         f"{msg['role'].capitalize()}: {msg['content']}" 
         for msg in conversation_history
     ])
     
-    prompt = f"""{DIAGNOSIS_SYSTEM_PROMPT}
-
-PATIENT CONVERSATION:
+    prompt = f"""PATIENT CONVERSATION:
 {history_text}
 
 MEDICAL REFERENCE INFORMATION (from MedlinePlus and Textbook):
-{retrieved_context}
-
-Based on the patient's symptoms and the medical references above, generate a comprehensive assessment that combines:
-- Clinical reasoning from the textbook
-- Patient-friendly explanations from MedlinePlus
-
-Format your response with these sections:
-
-## Likely Condition
-[Explain what the patient might be experiencing. Use clinical reasoning from the textbook AND patient-friendly language from MedlinePlus. Cite both sources when possible.]
-
-## Expected Progression (30/60/90 Days)
-- **30 days**: [What to expect in the first month]
-- **60 days**: [What to expect after two months]
-- **90 days**: [Long-term outlook]
-
-## Lifestyle Recommendations
-[Provide practical, evidence-based self-care advice from both sources]
-
-## Red Flags & Next Steps
-[List warning signs that require immediate medical attention. Be specific and cite sources.]
-
-## Citations
-- Textbook sources: [List relevant textbook sections referenced]
-- MedlinePlus sources: [List relevant MedlinePlus topics referenced]
-
-## Important Disclaimer
-This AI assessment is for informational purposes only and is not a substitute for professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment.
-
-Remember to:
-- Synthesize information naturally from BOTH sources
-- Cite appropriately (e.g., "According to the Symptom to Diagnosis textbook..." or "MedlinePlus indicates...")
-- Maintain a caring, professional tone
-- Focus on information actually present in the retrieved context"""
+{retrieved_context}"""
     
     return prompt
 
@@ -155,6 +229,10 @@ if __name__ == "__main__":
         {"role": "user", "content": "I have chest pain and shortness of breath"}
     ]
     
+    print("\n📋 Follow-up System Prompt:")
+    print("-"*60)
+    print(FOLLOW_UP_SYSTEM_PROMPT[:500] + "...")
+    
     print("\n📋 Follow-up Question Prompt:")
     print("-"*60)
     followup = create_followup_prompt(test_history, 1)
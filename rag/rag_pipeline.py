@@ -1,32 +1,177 @@
-import os
+import asyncio
+import re
 import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Optional
-import json
+from typing import List, Dict, Generator, Optional
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 from openai import OpenAI
 from rag.emergency_detector import EmergencyDetector
 
+try:
+    import tiktoken
+except ImportError:  # classifier runs without logit_bias
+    tiktoken = None
+
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from rag.retriever import MedlineRetriever
-from rag.prompts import create_diagnosis_prompt
+from rag.followup_manager import FollowUpManager
+from rag.openai_client import get_client, get_async_client, run_sync
+from rag.response_cache import ResponseCache
+from rag.prompts import (
+    create_diagnosis_prompt,
+    with_user_message,
+    DIAGNOSIS_MESSAGES,
+    DIAGNOSIS_TRIAGE_MESSAGES,
+    FALLBACK_DIAGNOSIS_MESSAGES,
+    FALLBACK_DIAGNOSIS_TRIAGE_MESSAGES
+)
 
 # Load environment variables
 load_dotenv()
 
+NON_MEDICAL_RESPONSE = """I am a medical symptom checker AI assistant, designed specifically to help with health-related questions and symptoms.
+
+I can only assist with:
+- Medical symptoms and health concerns
+- Disease information and conditions
+- Health guidance and recommendations
+- Medical questions and clarifications
+
+For non-medical questions, please use a general-purpose AI assistant or search engine.
+
+If you have any health-related symptoms or medical questions, I'm here to help! Please describe your symptoms."""
+
+INCOMPLETE_DIAGNOSIS_RESPONSE = """I'm sorry, I couldn't complete an assessment of your symptoms this time. Please try again in a moment.
+
+If your symptoms are severe or getting worse, please contact a healthcare provider or call emergency services."""
+
+TRUNCATION_NOTE = "\n\n*This assessment was cut short. Please ask again if you need more detail.*"
+
+# Classifier answers kept per pipeline, keyed on normalized input
+RELEVANCE_CACHE_SIZE = 10000
+
+# Completion budgets for a diagnosis; JSON escaping and the envelope need headroom
+DIAGNOSIS_MAX_TOKENS = 1500
+STRUCTURED_DIAGNOSIS_MAX_TOKENS = 1800
+
+# The "diagnosis" string of a possibly cut-off JSON reply, up to its closing quote
+_DIAGNOSIS_FIELD = re.compile(r'"diagnosis"\s*:\s*"((?:[^"\\]|\\.)*)', re.DOTALL)
+_NON_MEDICAL_FIELD = re.compile(r'"is_medical"\s*:\s*false')
+# A \uXXXX escape cut short, or a high surrogate whose pair was cut off
+_PARTIAL_UNICODE_ESCAPE = re.compile(
+    r'(?<!\\)((?:\\\\)*)(?:\\u[dD][89abAB][0-9a-fA-F]{2}(?:\\u[0-9a-fA-F]{0,3})?|\\u[0-9a-fA-F]{0,3})$'
+)
+
+
+@lru_cache(maxsize=1)
+def _yes_no_logit_bias() -> Optional[Dict[str, int]]:
+    """
+    logit_bias that restricts the classifier's reply to "YES" or "NO".
+    
+    Returns None when tiktoken (or its encoding file) is unavailable or
+    either word is not a single token, in which case the classifier runs
+    unbiased.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    except Exception as e:
+        print(f"   ⚠️ Could not load tokenizer for logit_bias: {e}")
+        return None
+    
+    token_ids = [encoding.encode(word) for word in ("YES", "NO")]
+    if any(len(ids) != 1 for ids in token_ids):
+        return None
+    return {str(ids[0]): 100 for ids in token_ids}
+
+
+def _salvage_diagnosis(raw_content: str) -> str:
+    """
+    Recover the diagnosis text from a JSON reply that did not parse.
+    
+    Replies cut off at max_tokens end inside the "diagnosis" string; this
+    returns the unescaped text written so far, or "" if there is none.
+    """
+    match = _DIAGNOSIS_FIELD.search(raw_content)
+    if not match:
+        return ""
+    
+    escaped = _PARTIAL_UNICODE_ESCAPE.sub(r"\1", match.group(1))
+    try:
+        return orjson.loads(f'"{escaped}"').strip()
+    except orjson.JSONDecodeError:
+        # Raw control characters inside the string - unescape the common cases
+        return (
+            escaped.replace('\\n', '\n')
+            .replace('\\t', '\t')
+            .replace('\\"', '"')
+            .replace('\\\\', '\\')
+            .strip()
+        )
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of user input used as a cache key."""
+    return unicodedata.normalize("NFC", text).strip().lower()
+
+
+def _classify_medical_relevance(client: OpenAI, user_input: str) -> bool:
+    """Ask the LLM whether user input is medical (YES) or not (NO)."""
+    prompt = f"""You are a medical query classifier. Determine if the following user input is related to health, medical symptoms, diseases, or healthcare.
+
+User input: "{user_input}"
+
+Respond with ONLY "YES" if it's medical/health-related, or "NO" if it's not.
+
+Examples:
+- "I have a headache" -> YES
+- "What causes diabetes?" -> YES
+- "How to treat a cold?" -> YES
+- "What is the use of a pen?" -> NO
+- "Tell me a joke" -> NO
+- "What's the weather?" -> NO
+
+Answer (YES or NO):"""
+
+    request = {
+        "model": "gpt-3.5-turbo",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.0,
+        "max_tokens": 10
+    }
+    logit_bias = _yes_no_logit_bias()
+    if logit_bias:
+        # Only YES/NO can be sampled, so a single decode step suffices
+        request.update(max_tokens=1, logit_bias=logit_bias)
+    
+    response = client.chat.completions.create(**request)
+    
+    answer = response.choices[0].message.content.strip().upper()
+    return answer.startswith("YES")
+
 
 class RAGPipeline:
     """Manages the complete RAG workflow for medical symptom checking."""
     
-    def __init__(self, store_dir: Path):
+    def __init__(self, store_dir: Path, client: Optional[OpenAI] = None):
         """
         Initialize RAG pipeline.
         
         Args:
             store_dir: Directory containing FAISS index and metadata
+            client: OpenAI client to use (defaults to the shared one)
         """
         print("🚀 Initializing RAG Pipeline...")
         
@@ -34,50 +179,53 @@ class RAGPipeline:
         data_dir = Path(__file__).parent.parent / 'data'
         self.retriever = MedlineRetriever(store_dir, data_dir)
         
-        # Initialize OpenAI client
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        self.client = OpenAI(api_key=api_key)
+        # Reuse diagnoses for repeats of the same (normalized) symptom text
+        self.response_cache = ResponseCache()
+        
+        # Medical-relevance answers by normalized input, least recently used first
+        self._relevance_cache: "OrderedDict[str, bool]" = OrderedDict()
+        self._relevance_lock = threading.Lock()
+        
+        # Shared OpenAI client - one connection pool for every conversation
+        self.client = client or get_client()
         
         print("✅ RAG Pipeline ready!")
     
+    def warmup(self):
+        """
+        Pay one-off first-request costs ahead of the first user query.
+        
+        Runs a throwaway retrieval (first encode and FAISS search) and opens
+        a keep-alive connection in the sync and async OpenAI pools with a
+        request that generates no tokens. Failures are reported, not raised.
+        """
+        async def open_async_connection():
+            # models.list() returns a paginator, which run_sync cannot take
+            await get_async_client().models.list()
+        
+        print("🔥 Warming up RAG pipeline...")
+        try:
+            self.retriever.retrieve("headache", top_k=1)
+            self.client.models.list()
+            run_sync(open_async_connection())
+            print("✓ Warmup complete")
+        except Exception as e:
+            print(f"⚠️ Warmup failed: {e}")
+    
     def check_medical_relevance(self, user_input: str) -> bool:
         """
         Check if the user input is related to medical/health topics.
         
+        Answers are memoized on the normalized input, so repeats of the
+        same question skip the API call.
+        
         Returns:
             bool: True if medical-related, False otherwise
         """
         print(f"🔍 Checking if query is medical-related...")
         
-        prompt = f"""You are a medical query classifier. Determine if the following user input is related to health, medical symptoms, diseases, or healthcare.
-
-User input: "{user_input}"
-
-Respond with ONLY "YES" if it's medical/health-related, or "NO" if it's not.
-
-Examples:
-- "I have a headache" -> YES
-- "What causes diabetes?" -> YES
-- "How to treat a cold?" -> YES
-- "What is the use of a pen?" -> NO
-- "Tell me a joke" -> NO
-- "What's the weather?" -> NO
-
-Answer (YES or NO):"""
-
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0,
-                max_tokens=10
-            )
-            
-            answer = response.choices[0].message.content.strip().upper()
-            is_medical = "YES" in answer
-            
+            is_medical = self._cached_medical_relevance(user_input)
             print(f"   {'✓' if is_medical else '✗'} Query classified as: {'Medical' if is_medical else 'Non-medical'}")
             return is_medical
             
@@ -86,10 +234,47 @@ Answer (YES or NO):"""
             # Default to True to avoid blocking legitimate queries
             return True
     
+    async def acheck_medical_relevance(self, user_input: str) -> bool:
+        """
+        Async version of check_medical_relevance.
+        
+        The blocking call runs in a worker thread so it shares the same
+        memoized classifier; a cancelled check still fills the cache.
+        """
+        return await asyncio.to_thread(self.check_medical_relevance, user_input)
+    
+    def _cached_medical_relevance(self, user_input: str) -> bool:
+        """
+        Classify user input, memoized on its normalized form.
+        
+        Only the cache key is normalized; the classifier sees the original
+        text. API errors propagate, so a failed call is never cached.
+        """
+        cache_key = normalize_query(user_input)
+        with self._relevance_lock:
+            is_medical = self._relevance_cache.get(cache_key)
+            if is_medical is not None:
+                self._relevance_cache.move_to_end(cache_key)
+                return is_medical
+        
+        is_medical = _classify_medical_relevance(self.client, user_input)
+        
+        with self._relevance_lock:
+            self._relevance_cache[cache_key] = is_medical
+            while len(self._relevance_cache) > RELEVANCE_CACHE_SIZE:
+                self._relevance_cache.popitem(last=False)
+        return is_medical
+    
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single query with the retriever's model."""
+        return self.retriever.encode_query(text)
+    
     def generate_diagnosis(
         self, 
         user_symptoms: str,
-        use_rag: bool = True
+        use_rag: bool = True,
+        query_embedding: Optional[np.ndarray] = None,
+        use_cache: bool = True
     ) -> Dict[str, any]:
         """
         Generate diagnosis from symptoms.
@@ -97,54 +282,243 @@ Answer (YES or NO):"""
         Args:
             user_symptoms: User's symptom description
             use_rag: Whether to use RAG retrieval (default True)
+            query_embedding: Embedding of user_symptoms, if the caller already
+                has one (e.g. from a batched encode_queries call)
+            use_cache: Serve and store the diagnosis through the response
+                cache, which only hits on the same normalized text
         
         Returns:
             Dict with diagnosis, sources, and metadata
         """
-        # First check if query is medical-related
-        if not self.check_medical_relevance(user_symptoms):
+        # Only full RAG requests are cached; use_rag may be switched off below.
+        # The lookup needs no embedding, so a hit skips the encoder too
+        use_cache = use_cache and use_rag
+        cache_key = normalize_query(user_symptoms)
+        if use_cache:
+            cached = self.response_cache.lookup(cache_key)
+            if cached is not None:
+                print(f"⚡ Response cache hit - reusing previous diagnosis")
+                return dict(cached)
+        
+        if query_embedding is None:
+            query_embedding = self.embed(user_symptoms)
+        
+        prepared = self._prepare_diagnosis(user_symptoms, query_embedding, use_rag)
+        
+        print(f"🤖 Classifying and generating diagnosis with GPT-3.5...")
+        
+        # One call both gates non-medical input and writes the diagnosis
+        response = self.client.chat.completions.create(
+            **self._diagnosis_request(prepared['messages'])
+        )
+        
+        choice = response.choices[0]
+        result, is_medical = self._finish_diagnosis(choice.message.content, prepared, choice.finish_reason)
+        
+        # A diagnosis cut short at max_tokens is shown once but not reused
+        if use_cache and is_medical and choice.finish_reason != "length":
+            self.response_cache.insert(cache_key, result)
+        
+        return result
+    
+    def stream_diagnosis(
+        self,
+        user_symptoms: str,
+        use_rag: bool = True,
+        check_relevance: bool = True,
+        use_cache: bool = True
+    ) -> Generator[str, None, Dict[str, any]]:
+        """
+        Stream a diagnosis as it is generated.
+        
+        Yields markdown text chunks as they arrive from the API. The
+        generator's return value (StopIteration.value) is the same dict
+        generate_diagnosis returns, including the full diagnosis text.
+        
+        Args:
+            user_symptoms: User's symptom description
+            use_rag: Whether to use RAG retrieval (default True)
+            check_relevance: Gate non-medical input first; callers that
+                already classified the input can skip it
+            use_cache: Serve and store the diagnosis through the response
+                cache, which only hits on the same normalized text
+        """
+        # The medical gate cannot share a streamed call, so it runs first
+        if check_relevance and not self.check_medical_relevance(user_symptoms):
+            yield NON_MEDICAL_RESPONSE
             return {
-                'diagnosis': """I am a medical symptom checker AI assistant, designed specifically to help with health-related questions and symptoms.
-
-I can only assist with:
-- Medical symptoms and health concerns
-- Disease information and conditions
-- Health guidance and recommendations
-- Medical questions and clarifications
-
-For non-medical questions, please use a general-purpose AI assistant or search engine.
-
-If you have any health-related symptoms or medical questions, I'm here to help! Please describe your symptoms.""",
+                'diagnosis': NON_MEDICAL_RESPONSE,
                 'sources': [],
+                'sources_by_type': {},
                 'used_rag': False,
                 'reason': 'Non-medical query rejected'
             }
         
+        use_cache = use_cache and use_rag
+        cache_key = normalize_query(user_symptoms)
+        if use_cache:
+            cached = self.response_cache.lookup(cache_key)
+            if cached is not None:
+                print(f"⚡ Response cache hit - reusing previous diagnosis")
+                yield cached['diagnosis']
+                return dict(cached)
+        
+        query_embedding = self.embed(user_symptoms)
+        prepared = self._prepare_diagnosis(user_symptoms, query_embedding, use_rag, structured=False)
+        
+        print(f"🤖 Streaming diagnosis with GPT-3.5...")
+        
+        stream = self.client.chat.completions.create(
+            **self._diagnosis_request(prepared['messages'], structured=False),
+            stream=True
+        )
+        
+        parts = []
+        finish_reason = None
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            delta = choice.delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        
+        # Same endings as _finish_diagnosis gives the non-streamed reply
+        diagnosis = "".join(parts).strip()
+        cacheable = bool(diagnosis) and finish_reason != "length"
+        if not diagnosis:
+            yield INCOMPLETE_DIAGNOSIS_RESPONSE
+            diagnosis = INCOMPLETE_DIAGNOSIS_RESPONSE
+        elif finish_reason == "length":
+            yield TRUNCATION_NOTE
+            diagnosis += TRUNCATION_NOTE
+        
+        result = self._build_result(diagnosis, prepared)
+        
+        # Cut-short or empty diagnoses are shown once but not reused
+        if use_cache and cacheable:
+            self.response_cache.insert(cache_key, result)
+        
+        return result
+    
+    def batch_generate_diagnosis(
+        self,
+        symptom_list: List[str],
+        poll_interval: float = 30.0
+    ) -> List[Dict[str, any]]:
+        """
+        Generate diagnoses for many inputs through the OpenAI Batch API.
+        
+        Meant for evaluations and backfills where latency does not matter:
+        batch requests cost half as much and do not count against the
+        interactive rate limit. Blocks until the batch finishes.
+        
+        Args:
+            symptom_list: Symptom descriptions to diagnose
+            poll_interval: Seconds between batch status checks
+        
+        Returns:
+            List of dicts in the same format as generate_diagnosis, in input order
+        """
+        query_embeddings = self.retriever.encode_queries(symptom_list)
+        prepared = [
+            self._prepare_diagnosis(user_symptoms, query_embedding, use_rag=True)
+            for user_symptoms, query_embedding in zip(symptom_list, query_embeddings)
+        ]
+        
+        requests = b"\n".join(
+            orjson.dumps({
+                "custom_id": f"diagnosis-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._diagnosis_request(item['messages'])
+            })
+            for i, item in enumerate(prepared)
+        )
+        batch_file = self.client.files.create(
+            file=("diagnosis_batch.jsonl", requests),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        print(f"📦 Submitted batch {batch.id} with {len(prepared)} requests")
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            print(f"   ⏳ Batch status: {batch.status}")
+        
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+        
+        # custom_id -> (content, finish_reason)
+        contents = {}
+        if batch.output_file_id:
+            output = self.client.files.content(batch.output_file_id).text
+            for line in output.splitlines():
+                record = orjson.loads(line)
+                response = record.get('response') or {}
+                if response.get('status_code') == 200:
+                    choice = response['body']['choices'][0]
+                    contents[record['custom_id']] = (choice['message']['content'], choice.get('finish_reason'))
+        
+        diagnoses = []
+        for i, item in enumerate(prepared):
+            content, finish_reason = contents.get(f"diagnosis-{i}", (None, None))
+            if content is None:
+                # Individual requests can fail inside a completed batch
+                print(f"   ⚠️ Request {i} missing from batch output, retrying directly")
+                response = self.client.chat.completions.create(
+                    **self._diagnosis_request(item['messages'])
+                )
+                content = response.choices[0].message.content
+                finish_reason = response.choices[0].finish_reason
+            diagnoses.append(self._finish_diagnosis(content, item, finish_reason)[0])
+        
+        return diagnoses
+    
+    def _prepare_diagnosis(
+        self,
+        user_symptoms: str,
+        query_embedding: np.ndarray,
+        use_rag: bool,
+        structured: bool = True
+    ) -> Dict[str, any]:
+        """
+        Retrieve context and build the chat messages for one diagnosis.
+        
+        With structured=True the system message also asks for the JSON
+        triage reply; streamed diagnoses are plain markdown instead.
+        
+        Returns:
+            Dict with 'messages', 'results', 'use_rag' and 'best_score'
+        """
         print(f"🔍 Retrieving relevant medical information...")
         
         # Try RAG retrieval first
-        results = self.retriever.retrieve(user_symptoms, top_k=5)
+        results = self.retriever.retrieve_with_embedding(query_embedding, top_k=5)
         
         # Check relevance of retrieved results
-        # If best score is too high (indicating poor match), fall back to LLM
-        best_score = results[0]['score'] if results else float('inf')
-        relevance_threshold = 0.7  # Lower score = better match in L2 distance
+        # If best match is too weak, fall back to LLM
+        best_score = results.best_score if results else float('inf')
         
-        if best_score > relevance_threshold:
+        if results and not self.retriever.is_relevant(best_score):
             use_rag = False
-            print(f"⚠️ Low relevance score ({best_score:.3f} > {relevance_threshold})")
+            print(f"⚠️ Low relevance score ({best_score:.3f})")
             print(f"   Falling back to LLM general medical knowledge")
         
         if use_rag and results:
-            context = self.retriever.format_context(results)
+            # Context and source counts were built during retrieval
+            context = results.formatted_context
             print(f"✓ Retrieved {len(results)} relevant sources")
             print(f"   - Best match score: {best_score:.3f}")
-            
-            # Count sources
-            textbook_count = sum(1 for r in results if r['source_type'] == 'textbook')
-            medline_count = sum(1 for r in results if r['source_type'] == 'medlineplus')
-            print(f"   - Textbook sources: {textbook_count}")
-            print(f"   - MedlinePlus sources: {medline_count}")
+            print(f"   - Textbook sources: {results.textbook_count}")
+            print(f"   - MedlinePlus sources: {results.medline_count}")
         else:
             context = "No specific medical reference information retrieved. Using general medical knowledge."
             print(f"⚠️ No relevant sources found - using LLM general knowledge")
@@ -154,68 +528,125 @@ If you have any health-related symptoms or medical questions, I'm here to help!
             {"role": "user", "content": user_symptoms}
         ]
         
-        # Generate diagnosis
+        # Static instructions are a prebuilt system message, so the request
+        # prefix is identical across calls and cacheable
         if use_rag and results:
             prompt = create_diagnosis_prompt(conversation_history, context)
-            system_message = "You are a knowledgeable medical AI assistant with access to MedlinePlus and medical textbook information."
+            static_messages = DIAGNOSIS_TRIAGE_MESSAGES if structured else DIAGNOSIS_MESSAGES
         else:
             # Fallback prompt without RAG
-            prompt = f"""Based on the patient's symptoms: "{user_symptoms}"
-
-Provide a medical assessment using your general medical knowledge. Include:
-
-## Likely Condition
-[Explain possible conditions based on the symptoms]
-
-## Expected Progression (30/60/90 Days)
-- **30 days**: [Short-term outlook]
-- **60 days**: [Medium-term outlook]
-- **90 days**: [Long-term outlook]
-
-## Lifestyle Recommendations
-[Self-care and lifestyle advice]
-
-## Red Flags & Next Steps
-[Warning signs requiring immediate medical attention]
-
-## Important Note
-⚠️ **Note**: This response is based on general medical knowledge as specific reference materials did not contain directly relevant information for your symptoms. For accurate diagnosis and treatment, please consult a healthcare provider.
-
-## Important Disclaimer
-This AI assessment is for informational purposes only and is not a substitute for professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment."""
-            
-            system_message = "You are a knowledgeable medical AI assistant."
+            prompt = f'Patient\'s symptoms: "{user_symptoms}"'
+            static_messages = FALLBACK_DIAGNOSIS_TRIAGE_MESSAGES if structured else FALLBACK_DIAGNOSIS_MESSAGES
         
-        print(f"🤖 Generating diagnosis with GPT-3.5...")
+        return {
+            'messages': with_user_message(static_messages, prompt),
+            'results': results,
+            'use_rag': use_rag,
+            'best_score': best_score
+        }
+    
+    def _diagnosis_request(self, messages: List[Dict[str, str]], structured: bool = True) -> Dict[str, any]:
+        """
+        Chat completion parameters for a diagnosis, shared by live, batch and streamed calls.
         
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1500
-        )
+        The JSON reply repeats the whole diagnosis inside an escaped string
+        plus the is_medical envelope, so it gets a larger budget than the
+        plain streamed markdown.
+        """
+        request = {
+            "model": "gpt-3.5-turbo",
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": STRUCTURED_DIAGNOSIS_MAX_TOKENS if structured else DIAGNOSIS_MAX_TOKENS
+        }
+        if structured:
+            request["response_format"] = {"type": "json_object"}
+        return request
+    
+    def _finish_diagnosis(
+        self,
+        raw_content: Optional[str],
+        prepared: Dict[str, any],
+        finish_reason: Optional[str] = None
+    ) -> tuple:
+        """
+        Turn the model's JSON reply into the pipeline's result dict.
+        
+        The raw JSON is never shown to the patient: a reply cut off at
+        max_tokens (finish_reason "length") or otherwise malformed keeps
+        whatever diagnosis text it contains, with a note that it was cut
+        short, or falls back to INCOMPLETE_DIAGNOSIS_RESPONSE.
+        
+        Args:
+            raw_content: Message content of the JSON-mode completion
+            prepared: Output of _prepare_diagnosis for this request
+            finish_reason: Completion finish_reason, if known
+        
+        Returns:
+            tuple: (result dict, whether the input was classified as medical)
+        """
+        raw_content = (raw_content or "").strip()
+        truncated = finish_reason == "length"
+        try:
+            payload = orjson.loads(raw_content)
+        except orjson.JSONDecodeError:
+            payload = None
+        
+        if not isinstance(payload, dict):
+            if raw_content and not raw_content.startswith('{'):
+                # Plain text despite JSON mode - it is the diagnosis itself
+                diagnosis = raw_content
+            else:
+                print(f"   ⚠️ Structured response {'truncated' if truncated else 'malformed'}, salvaging diagnosis text")
+                diagnosis = _salvage_diagnosis(raw_content)
+                truncated = True
+            payload = {
+                'is_medical': not _NON_MEDICAL_FIELD.search(raw_content),
+                'diagnosis': diagnosis
+            }
         
-        diagnosis_text = response.choices[0].message.content.strip()
+        if not payload.get('is_medical', True):
+            print(f"   ✗ Query classified as: Non-medical")
+            return {
+                'diagnosis': NON_MEDICAL_RESPONSE,
+                'sources': [],
+                'sources_by_type': {},
+                'used_rag': False,
+                'reason': 'Non-medical query rejected'
+            }, False
+        
+        diagnosis = str(payload.get('diagnosis') or '').strip()
+        if not diagnosis:
+            diagnosis = INCOMPLETE_DIAGNOSIS_RESPONSE
+        elif truncated:
+            diagnosis += TRUNCATION_NOTE
+        
+        return self._build_result(diagnosis, prepared), True
+    
+    def _build_result(self, diagnosis_text: str, prepared: Dict[str, any]) -> Dict[str, any]:
+        """Attach sources and retrieval metadata to a finished diagnosis."""
+        results = prepared['results']
+        use_rag = prepared['use_rag']
+        best_score = prepared['best_score']
         
-        # Extract sources for citations
+        # Extract sources for citations, grouped by type in the same pass
         sources = []
+        sources_by_type = defaultdict(list)
         if use_rag and results:
-            sources = [
-                {
+            for result in results:
+                source = {
                     'title': result['title'],
                     'url': result['url'],
                     'source_type': result['source_type'],
                     'relevance_score': result['score']
                 }
-                for result in results
-            ]
+                sources.append(source)
+                sources_by_type[source['source_type']].append(source)
         
         return {
             'diagnosis': diagnosis_text,
             'sources': sources,
+            'sources_by_type': dict(sources_by_type),
             'used_rag': use_rag and bool(results),
             'reason': 'RAG retrieval successful' if (use_rag and results) else 'No relevant sources - using LLM knowledge',
             'best_score': best_score if results else None
@@ -262,6 +693,7 @@ class ConversationManager:
                 'type': 'diagnosis',
                 'content': result['diagnosis'],
                 'sources': result['sources'],
+                'sources_by_type': result.get('sources_by_type', {}),
                 'used_rag': result.get('used_rag', False),
                 'reason': result.get('reason', ''),
                 'best_score': result.get('best_score')
@@ -274,20 +706,15 @@ class ConversationManager:
             }
 
 
-class ConversationManagerWithFollowUps:
-    """Enhanced conversation manager with follow-up questions."""
-    
-    def __init__(self, rag_pipeline: RAGPipeline, num_followups: int = 3):
-        self.pipeline = rag_pipeline
-        self.num_followups = num_followups
-        self.conversation_history: List[Dict[str, str]] = []
-        self.stage = "initial"  # initial, followup, diagnosis, complete
-        self.followup_count = 0
-        
-        # Import here to avoid circular imports
-        sys.path.append(str(Path(__file__).parent.parent))
-        from rag.followup_manager import FollowUpManager
-        self.followup_manager = FollowUpManager()
+@dataclass
+class ConversationState:
+    """Per-session progress through the follow-up conversation."""
+    conversation_history: List[Dict[str, str]] = field(default_factory=list)
+    # " | "-joined user messages, extended as each one arrives
+    symptoms_summary: str = ""
+    stage: str = "initial"  # initial, followup, diagnosis, complete
+    followup_count: int = 0
+    planned_questions: List[str] = field(default_factory=list)
     
     def add_user_message(self, message: str):
         """Add user message to conversation history."""
@@ -295,6 +722,7 @@ class ConversationManagerWithFollowUps:
             'role': 'user',
             'content': message
         })
+        self.symptoms_summary = f"{self.symptoms_summary} | {message}" if self.symptoms_summary else message
     
     def add_assistant_message(self, message: str):
         """Add assistant message to conversation history."""
@@ -302,12 +730,127 @@ class ConversationManagerWithFollowUps:
             'role': 'assistant',
             'content': message
         })
+    
+    def reset(self):
+        """Return to the initial stage for a new assessment."""
+        self.conversation_history.clear()
+        self.symptoms_summary = ""
+        self.stage = "initial"
+        self.followup_count = 0
+        self.planned_questions.clear()
 
 
-    def process_message(self, user_input: str) -> Dict:
+class ConversationEngine:
+    """
+    Stateless driver of the follow-up conversation.
+    
+    Holds the pipeline, follow-up generator and emergency detector; every
+    call takes the ConversationState of one session. A server builds one
+    engine per process and keeps only a state per session.
+    """
+    
+    def __init__(
+        self,
+        rag_pipeline: RAGPipeline,
+        num_followups: int = 3,
+        pregenerate_followups: bool = True
+    ):
+        """
+        Args:
+            rag_pipeline: Pipeline used for triage and the final diagnosis
+            num_followups: Number of follow-up questions to ask
+            pregenerate_followups: Plan every follow-up question in one LLM
+                call after the first message instead of one call per question
+        """
+        self.pipeline = rag_pipeline
+        self.num_followups = num_followups
+        self.pregenerate_followups = pregenerate_followups
+        
+        self.followup_manager = FollowUpManager(client=rag_pipeline.client)
+        self.emergency_detector = EmergencyDetector()
+    
+    def process_message(self, state: ConversationState, user_input: str) -> Dict:
+        """
+        Synchronous wrapper around aprocess_message for non-async callers.
+        
+        Runs on the shared OpenAI event loop: the async client keeps pooled
+        connections bound to that loop, so a fresh asyncio.run() per message
+        would strand them.
+        """
+        return run_sync(self.aprocess_message(state, user_input))
+    
+    def process_message_stream(
+        self,
+        state: ConversationState,
+        user_input: str
+    ) -> Generator[Dict, None, None]:
+        """
+        Streaming counterpart of process_message for UIs.
+        
+        Yields typed events. The answer to the last follow-up streams the
+        diagnosis as {'kind': 'token', 'text': ...} events; every call ends
+        with one {'kind': 'final', 'response': ...} event carrying the dict
+        process_message would return. Emergencies, rejections and
+        follow-up questions are not streamed, so their first event is the
+        final one.
+        """
+        if state.stage != "followup" or state.followup_count + 1 <= self.num_followups:
+            yield {'kind': 'final', 'response': self.process_message(state, user_input)}
+            return
+        
+        # Last follow-up answered: same transition as aprocess_message
+        state.add_user_message(user_input)
+        state.followup_count += 1
+        state.stage = "diagnosis"
+        
+        stream = self.stream_diagnosis(state)
+        while True:
+            try:
+                text = next(stream)
+            except StopIteration as done:
+                yield {'kind': 'final', 'response': done.value}
+                return
+            yield {'kind': 'token', 'text': text}
+    
+    async def _next_followup_question(self, state: ConversationState) -> str:
+        """
+        Question for the current followup_count.
+        
+        Served from the pre-generated plan when available; any question the
+        plan is missing is generated individually.
+        """
+        index = state.followup_count - 1
+        if index < len(state.planned_questions):
+            return state.planned_questions[index]
+        
+        return await self.followup_manager.agenerate_followup_question(
+            state.conversation_history,
+            state.followup_count,
+            state.symptoms_summary
+        )
+    
+    async def _triage(self, user_input: str) -> tuple:
+        """
+        Run emergency detection, then the medical-relevance check.
+        
+        Detection is a microsecond keyword scan, so it runs inline; a
+        thread hop would cost more than the scan. An emergency returns
+        before the relevance API call is ever made.
+        
+        Returns:
+            tuple: (emergency result dict, is_medical - None for emergencies)
+        """
+        emergency_result = self.emergency_detector.detect(user_input)
+        if emergency_result['is_emergency']:
+            return emergency_result, None
+        
+        return emergency_result, await self.pipeline.acheck_medical_relevance(user_input)
+    
+    async def aprocess_message(self, state: ConversationState, user_input: str) -> Dict:
         """
         Process user message through the conversation flow:
-        0. Check for emergency symptoms (if initial)
+        0. Check for emergency symptoms (if initial), planning the
+           follow-up questions at the same time
         1. Initial symptoms
         2. Follow-up questions (3-4)
         3. Final diagnosis
@@ -316,13 +859,35 @@ class ConversationManagerWithFollowUps:
             Dict with 'type', 'content', and metadata
         """
         # Add user input to history
-        self.add_user_message(user_input)
+        state.add_user_message(user_input)
         
         # Initial symptoms
-        if self.stage == "initial":
-            # FIRST: Check for emergency symptoms
-            emergency_detector = EmergencyDetector()
-            emergency_result = emergency_detector.detect(user_input)
+        if state.stage == "initial":
+            # Plan the follow-ups speculatively while triage runs; the plan
+            # is only used if the message passes both checks. Emergencies
+            # are found before the first await, so their plan never starts;
+            # rejections still pay for the (cancelled) plan request -
+            # accepted so the common medical path does not wait for it
+            plan_task = None
+            if self.pregenerate_followups:
+                plan_task = asyncio.ensure_future(self.followup_manager.agenerate_all_followups(
+                    state.symptoms_summary,
+                    self.num_followups
+                ))
+                # A plan that fails and is then discarded should not log
+                # "Task exception was never retrieved"
+                plan_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            
+            # Emergency detection, then the medical-relevance check
+            try:
+                emergency_result, is_medical = await self._triage(user_input)
+            except BaseException:
+                if plan_task:
+                    plan_task.cancel()
+                raise
+            
+            if plan_task and (emergency_result['is_emergency'] or not is_medical):
+                plan_task.cancel()
             
             if emergency_result['is_emergency']:
                 print(f"\n🚨 EMERGENCY DETECTED: {emergency_result['severity']}")
@@ -338,69 +903,62 @@ class ConversationManagerWithFollowUps:
                 }
             
             # Check if medical-related
-            if not self.pipeline.check_medical_relevance(user_input):
+            if not is_medical:
                 return {
                     'type': 'rejection',
-                    'content': """I am a medical symptom checker AI assistant, designed specifically to help with health-related questions and symptoms.
-
-I can only assist with:
-- Medical symptoms and health concerns
-- Disease information and conditions
-- Health guidance and recommendations
-- Medical questions and clarifications
-
-For non-medical questions, please use a general-purpose AI assistant or search engine.
-
-If you have any health-related symptoms or medical questions, I'm here to help! Please describe your symptoms.""",
+                    'content': NON_MEDICAL_RESPONSE,
                     'stage': 'initial'
                 }
             
             # Move to follow-up stage
-            self.stage = "followup"
-            self.followup_count = 1
+            state.stage = "followup"
+            state.followup_count = 1
+            
+            if plan_task:
+                try:
+                    state.planned_questions = await plan_task
+                except Exception as e:
+                    # Each question is then generated on its own
+                    print(f"   ⚠️ Follow-up planning failed: {e}")
+                    state.planned_questions = []
             
-            # Generate first follow-up question
-            question = self.followup_manager.generate_followup_question(
-                self.conversation_history, 
-                self.followup_count
-            )
-            self.add_assistant_message(question)
+            # First follow-up question
+            question = await self._next_followup_question(state)
+            state.add_assistant_message(question)
             
             return {
                 'type': 'followup_question',
                 'content': question,
-                'question_num': self.followup_count,
+                'question_num': state.followup_count,
                 'total_questions': self.num_followups,
                 'stage': 'followup'
             }
         
         # Follow-up Q&A stage
-        elif self.stage == "followup":
-            self.followup_count += 1
+        elif state.stage == "followup":
+            state.followup_count += 1
             
             # Check if we've asked enough questions
-            if self.followup_count > self.num_followups:
+            if state.followup_count > self.num_followups:
                 # Move to diagnosis
-                self.stage = "diagnosis"
-                return self._generate_diagnosis()
+                state.stage = "diagnosis"
+                # Blocking pipeline call; keep the shared event loop free
+                return await asyncio.to_thread(self._generate_diagnosis, state)
             else:
-                # Generate next follow-up question
-                question = self.followup_manager.generate_followup_question(
-                    self.conversation_history,
-                    self.followup_count
-                )
-                self.add_assistant_message(question)
+                # Next follow-up question
+                question = await self._next_followup_question(state)
+                state.add_assistant_message(question)
                 
                 return {
                     'type': 'followup_question',
                     'content': question,
-                    'question_num': self.followup_count,
+                    'question_num': state.followup_count,
                     'total_questions': self.num_followups,
                     'stage': 'followup'
                 }
         
         # After diagnosis
-        elif self.stage == "complete":
+        elif state.stage == "complete":
             return {
                 'type': 'complete',
                 'content': "Thank you for using the symptom checker. If you have new symptoms, please start a new session.",
@@ -408,18 +966,44 @@ If you have any health-related symptoms or medical questions, I'm here to help!
             }
     
     
-    def _generate_diagnosis(self) -> Dict:
+    def stream_diagnosis(self, state: ConversationState) -> Generator[str, None, Dict]:
+        """
+        Streaming counterpart of _generate_diagnosis for UIs.
+        
+        Yields diagnosis text chunks; the return value is the same response
+        dict _generate_diagnosis produces.
+        """
+        all_symptoms = state.symptoms_summary
+        
+        # The initial message already passed the medical-relevance gate.
+        # The cache key is the whole summary, answers included, so only an
+        # identical consultation is served from it
+        result = yield from self.pipeline.stream_diagnosis(
+            all_symptoms, use_rag=True, check_relevance=False
+        )
+        
+        state.add_assistant_message(result['diagnosis'])
+        state.stage = "complete"
+        
+        return {
+            'type': 'diagnosis',
+            'content': result['diagnosis'],
+            'sources': result['sources'],
+            'sources_by_type': result.get('sources_by_type', {}),
+            'used_rag': result.get('used_rag', False),
+            'reason': result.get('reason', ''),
+            'best_score': result.get('best_score'),
+            'stage': 'complete'
+        }
+    
+    def _generate_diagnosis(self, state: ConversationState) -> Dict:
         """Generate final diagnosis after all follow-ups."""
         print(f"\n{'='*70}")
         print("ALL FOLLOW-UPS COMPLETE - GENERATING DIAGNOSIS")
         print(f"{'='*70}")
         
-        # Combine all user inputs (symptoms + answers)
-        all_symptoms = " | ".join([
-            msg['content'] 
-            for msg in self.conversation_history 
-            if msg['role'] == 'user'
-        ])
+        # All user inputs (symptoms + answers), kept up to date as they arrive
+        all_symptoms = state.symptoms_summary
         
         print(f"📝 Combined patient information:")
         print(f"   {all_symptoms[:200]}...")
@@ -427,19 +1011,66 @@ If you have any health-related symptoms or medical questions, I'm here to help!
         # Generate diagnosis using RAG
         result = self.pipeline.generate_diagnosis(all_symptoms, use_rag=True)
         
-        self.add_assistant_message(result['diagnosis'])
-        self.stage = "complete"
+        state.add_assistant_message(result['diagnosis'])
+        state.stage = "complete"
         
         return {
             'type': 'diagnosis',
             'content': result['diagnosis'],
             'sources': result['sources'],
+            'sources_by_type': result.get('sources_by_type', {}),
             'used_rag': result.get('used_rag', False),
             'reason': result.get('reason', ''),
             'best_score': result.get('best_score'),
             'stage': 'complete'
         }
 
+
+class ConversationManagerWithFollowUps:
+    """
+    Enhanced conversation manager with follow-up questions.
+    
+    Pairs a ConversationEngine with a single ConversationState for
+    callers that run one conversation at a time.
+    """
+    
+    def __init__(
+        self,
+        rag_pipeline: RAGPipeline,
+        num_followups: int = 3,
+        pregenerate_followups: bool = True
+    ):
+        """
+        Args:
+            rag_pipeline: Pipeline used for triage and the final diagnosis
+            num_followups: Number of follow-up questions to ask
+            pregenerate_followups: Plan every follow-up question in one LLM
+                call after the first message instead of one call per question
+        """
+        self.engine = ConversationEngine(rag_pipeline, num_followups, pregenerate_followups)
+        self.state = ConversationState()
+    
+    def process_message(self, user_input: str) -> Dict:
+        """See ConversationEngine.process_message."""
+        return self.engine.process_message(self.state, user_input)
+    
+    async def aprocess_message(self, user_input: str) -> Dict:
+        """See ConversationEngine.aprocess_message."""
+        return await self.engine.aprocess_message(self.state, user_input)
+    
+    def process_message_stream(self, user_input: str) -> Generator[Dict, None, None]:
+        """See ConversationEngine.process_message_stream."""
+        return self.engine.process_message_stream(self.state, user_input)
+    
+    def stream_diagnosis(self) -> Generator[str, None, Dict]:
+        """See ConversationEngine.stream_diagnosis."""
+        return self.engine.stream_diagnosis(self.state)
+    
+    def reset(self):
+        """Start a new conversation; the engine and its pipeline are kept."""
+        self.state.reset()
+
+
 if __name__ == "__main__":
     project_root = Path(__file__).parent.parent
     store_dir = project_root / 'store'
@@ -459,14 +1090,31 @@ if __name__ == "__main__":
         "I have chest pain and shortness of breath"
     ]
     
-    for i, test_input in enumerate(test_cases, 1):
+    async def run_case(test_input: str, semaphore: asyncio.Semaphore) -> Dict:
+        """Run one test case in a worker thread, bounded by the semaphore."""
+        async with semaphore:
+            manager = ConversationManager(pipeline)
+            return await asyncio.to_thread(manager.process_message, test_input)
+    
+    async def run_all_cases() -> List[Dict]:
+        # At most 4 cases in flight to stay inside the API rate limit
+        semaphore = asyncio.Semaphore(4)
+        return await asyncio.gather(*(run_case(t, semaphore) for t in test_cases))
+    
+    # --batch submits every test case as one Batch API job instead of live calls
+    if "--batch" in sys.argv:
+        responses = [
+            {'content': result['diagnosis'], **result}
+            for result in pipeline.batch_generate_diagnosis(test_cases)
+        ]
+    else:
+        responses = asyncio.run(run_all_cases())
+    
+    for i, (test_input, response) in enumerate(zip(test_cases, responses), 1):
         print(f"\n{'='*70}")
         print(f"TEST CASE {i}: {test_input}")
         print(f"{'='*70}")
         
-        manager = ConversationManager(pipeline)
-        response = manager.process_message(test_input)
-        
         print(f"\n🤖 RESPONSE:")
         print(f"{'-'*70}")
         print(f"{response['content'][:500]}...")
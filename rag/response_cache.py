@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class ResponseCache:
+    """
+    LRU cache of pipeline responses keyed on normalized query text.
+    
+    Only an identical key is a hit. Embedding similarity is not enough:
+    descriptions that differ in one clinical detail, such as a "mild"
+    versus "above 104°F" fever, embed well above 0.9 cosine similarity
+    but must not share a diagnosis.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        """
+        Args:
+            max_entries: Entries kept before the least recently used is evicted
+            ttl_seconds: Age after which an entry is no longer served
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        
+        # key -> (created_at, response), least recently used first
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def lookup(self, key: str) -> Optional[Dict]:
+        """
+        Return the cached response for a query.
+        
+        Args:
+            key: Normalized query text the response was stored under
+        
+        Returns:
+            Cached response dict, or None on a miss
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            
+            created_at, response = entry
+            if time.monotonic() - created_at > self.ttl_seconds:
+                del self.entries[key]
+                return None
+            
+            self.entries.move_to_end(key)
+            return response
+    
+    def insert(self, key: str, response: Dict):
+        """
+        Store a response for a query.
+        
+        Args:
+            key: Normalized query text; later lookups must match it exactly
+            response: Pipeline response dict to serve on later hits
+        """
+        with self._lock:
+            self.entries[key] = (time.monotonic(), response)
+            self.entries.move_to_end(key)
+            
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
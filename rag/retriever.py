@@ -1,11 +1,176 @@
+"""
+FAISS retrieval over the MedlinePlus and textbook chunks.
+
+Query encoding (torch) and index search (FAISS/OpenMP) share the CPU.
+Torch gets half the cores and FAISS the rest, set once per process:
+the OpenMP thread count is process-global, so changing it per call
+would race between concurrent sessions. FAISS parallelizes across the
+queries in a block, so a single-query search still runs on one thread
+while retrieve_batch spreads its block over FAISS's share. Setting
+OMP_WAIT_POLICY=PASSIVE in the environment also stops idle OpenMP
+workers from spinning between queries.
+
+When many sessions encode at once (e.g. the Streamlit app under load),
+set DOCTORBOT_TORCH_THREADS=1 so concurrent queries each take one core
+instead of all contending for the same half.
+"""
+import json
+import os
 import faiss
 import numpy as np
 import pandas as pd
 import pickle
+import threading
+import torch
+import pyarrow.csv as pacsv
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict
-import streamlit as st
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional
+from rag.embedding_backend import load_embedding_model, select_device
+
+
+def _read_metadata(metadata_path: Path) -> pd.DataFrame:
+    """Load chunk metadata from Parquet, falling back to legacy pickles."""
+    if metadata_path.suffix == '.parquet':
+        # Read through the OS page cache instead of a private file buffer
+        return pd.read_parquet(metadata_path, engine='pyarrow', memory_map=True)
+    return pd.read_pickle(metadata_path)
+
+
+# Below this many chunks the retriever's own build keeps an exact flat index
+HNSW_MIN_VECTORS = 1000
+
+# Candidate list size for HNSW queries; higher trades latency for recall
+HNSW_EF_SEARCH = 64
+
+# Above this many chunks the build clusters vectors into an IVF index
+IVF_MIN_VECTORS = 10_000
+
+# IVF clusters scanned per query
+IVF_NPROBE = 8
+
+# Query embeddings remembered by encode_query before the oldest is dropped
+QUERY_CACHE_SIZE = 512
+RESULT_CACHE_SIZE = 512
+
+# Bumped when the store layout changes; other manifest versions are ignored
+MANIFEST_VERSION = 2
+
+
+@lru_cache(maxsize=1)
+def _load_bge_model() -> SentenceTransformer:
+    """
+    Load the query encoder once per process; every retriever shares it.
+    
+    A plain lru_cache keeps rag/ free of Streamlit for the build and eval
+    scripts; the app caches the whole pipeline with st.cache_resource.
+    """
+    return load_embedding_model('BAAI/bge-small-en-v1.5', device=select_device())
+
+
+def _query_key(query: str) -> str:
+    """
+    Cache key for a query.
+    
+    The BGE tokenizer lowercases and splits on whitespace, so queries that
+    differ only in case or spacing encode to the same vector.
+    """
+    return " ".join(query.split()).lower()
+
+
+def _configure_threads():
+    """Split CPU threads between the query encoder and FAISS."""
+    cpu_count = os.cpu_count() or 1
+    torch_threads = os.getenv('DOCTORBOT_TORCH_THREADS')
+    if torch_threads:
+        torch_threads = max(1, int(torch_threads))
+    else:
+        torch_threads = max(1, cpu_count // 2)
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only settable once per process, before any inter-op work
+        pass
+    # Process-global, so it is never changed per search
+    faiss.omp_set_num_threads(max(1, cpu_count - torch_threads))
+
+
+def _write_manifest(store_dir: Path, metadata_name: str):
+    """Record the store's artifact filenames for the next load."""
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'files': {
+            'index': 'faiss_index.bin',
+            'metadata': metadata_name,
+            'config': 'config.pkl'
+        }
+    }
+    with open(store_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _set_search_params(index):
+    """Apply query-time search parameters to graph indexes."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+
+
+def _valid_hits(distances: np.ndarray, indices: np.ndarray):
+    """
+    Drop padding and invalid scores from one query's search results.
+    
+    Graph indexes pad with id -1 when they find fewer than top_k hits.
+    The filtering is vectorized, and scores come back as Python floats
+    in one conversion instead of one float() per hit.
+    
+    Returns:
+        tuple: (list of float scores, int64 array of chunk positions)
+    """
+    valid = (indices >= 0) & np.isfinite(distances)
+    return distances[valid].tolist(), indices[valid]
+
+
+# Context label per source type; anything else is labelled MedlinePlus
+_SOURCE_LABELS = {'textbook': "Textbook"}
+
+
+def _format_source(result: Dict) -> str:
+    """Format one retrieved chunk as a labelled context block."""
+    return (
+        f"[Source: {_SOURCE_LABELS.get(result['source_type'], 'MedlinePlus')} - {result['title']}]\n"
+        f"{result['text']}\n"
+    )
+
+
+@dataclass
+class RetrievalBundle:
+    """
+    Retrieved chunks plus summaries computed in the same pass over them.
+    
+    Behaves like the plain list of result dicts retrieve() used to return
+    (iteration, len, indexing and truthiness), so existing callers work
+    unchanged.
+    """
+    items: List[Dict] = field(default_factory=list)
+    textbook_count: int = 0
+    medline_count: int = 0
+    formatted_context: str = ""
+    best_score: Optional[float] = None
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def __getitem__(self, index):
+        return self.items[index]
 
 
 class MedlineRetriever:
@@ -13,7 +178,7 @@ class MedlineRetriever:
     
     def __init__(self, store_dir: Path, data_dir: Path = None):
         """
-        Load or build FAISS index, embeddings, and metadata.
+        Load or build FAISS index and metadata.
         
         Args:
             store_dir: Directory where FAISS index will be stored/loaded
@@ -27,63 +192,128 @@ class MedlineRetriever:
         
         # Load embedding model first
         print("🔄 Loading embedding model...")
-        self.model = self._load_embedding_model()
+        self.model = _load_bge_model()
+        _configure_threads()
         print(f"✓ Loaded embedding model")
         
+        # Follow-up turns and repeated questions re-use earlier encodes and
+        # searches; both caches are LRU and share one lock
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._result_cache: "OrderedDict[tuple, RetrievalBundle]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
         # Load or build index
+        self.metric = 'l2'
         self.index, self.chunks_df = self._load_or_build_index()
+        self._cache_chunk_columns()
+        
+        # With GPU FAISS installed, search next to the encoder on the device
+        self._gpu_resources = None
+        if select_device() == 'cuda':
+            self._move_index_to_gpu()
+    
+    def _move_index_to_gpu(self):
+        """Copy the index to GPU 0, keeping the CPU index if that is not possible."""
+        if not hasattr(faiss, 'StandardGpuResources'):
+            return
+        try:
+            # Lets index.search() take torch tensors without a host copy
+            import faiss.contrib.torch_utils  # noqa: F401
+            resources = faiss.StandardGpuResources()
+            self.index = faiss.index_cpu_to_gpu(resources, 0, self.index)
+            self._gpu_resources = resources
+            print(f"✓ Moved FAISS index to GPU")
+        except Exception as e:
+            # e.g. HNSW graphs have no GPU implementation
+            print(f"⚠️ Keeping FAISS index on CPU: {e}")
+    
+    def _cache_chunk_columns(self):
+        """
+        Keep chunk metadata as parallel object arrays indexed by FAISS id.
+        
+        Building a result then costs a few array lookups per hit instead
+        of materializing a pandas Series with iloc. chunks_df is kept for
+        inspection only.
+        """
+        self._chunk_ids = self.chunks_df['chunk_id'].to_numpy(object)
+        self._titles = self.chunks_df['title'].to_numpy(object)
+        self._texts = self.chunks_df['chunk_text'].to_numpy(object)
+        self._urls = self.chunks_df['url'].to_numpy(object)
+        if 'source_type' in self.chunks_df.columns:
+            self._source_types = self.chunks_df['source_type'].to_numpy(object)
+        else:
+            self._source_types = np.full(len(self.chunks_df), 'unknown', dtype=object)
     
-    @st.cache_resource
-    def _load_embedding_model(_self):
-        """Load embedding model (cached)"""
-        return SentenceTransformer('BAAI/bge-small-en-v1.5')
+    def _metadata_path(self) -> Path:
+        """Chunk metadata file: Parquet, or the pickle written by older builds"""
+        parquet_path = self.store_dir / 'chunks_metadata.parquet'
+        if parquet_path.exists():
+            return parquet_path
+        return self.store_dir / 'chunks_metadata.pkl'
     
     def _index_exists(self) -> bool:
         """Check if FAISS index and metadata exist"""
         index_path = self.store_dir / 'faiss_index.bin'
-        metadata_path = self.store_dir / 'chunks_metadata.pkl'
-        embeddings_path = self.store_dir / 'embeddings.npy'
+        metadata_path = self._metadata_path()
         config_path = self.store_dir / 'config.pkl'
         
         return all([
             index_path.exists(), 
             metadata_path.exists(),
-            embeddings_path.exists(),
             config_path.exists()
         ])
     
-    def _load_existing_index(self):
-        """Load existing FAISS index and metadata"""
-        print("🔄 Loading existing FAISS index...")
+    def _read_manifest(self) -> Optional[Dict[str, str]]:
+        """
+        Artifact filenames recorded by the last save.
         
-        index_path = self.store_dir / 'faiss_index.bin'
-        metadata_path = self.store_dir / 'chunks_metadata.pkl'
-        embeddings_path = self.store_dir / 'embeddings.npy'
-        config_path = self.store_dir / 'config.pkl'
+        One read replaces a stat per artifact, which matters on network
+        filesystems. Returns None for stores saved before manifests existed.
+        """
+        try:
+            with open(self.store_dir / 'manifest.json', 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if manifest.get('version') != MANIFEST_VERSION:
+            return None
+        return manifest['files']
+    
+    def _default_files(self) -> Dict[str, str]:
+        """Artifact filenames used by stores saved without a manifest."""
+        return {
+            'index': 'faiss_index.bin',
+            'metadata': self._metadata_path().name,
+            'config': 'config.pkl'
+        }
+    
+    def _load_existing_index(self, files: Dict[str, str]):
+        """
+        Load existing FAISS index and metadata.
         
-        # Check if all required files exist
-        missing_files = []
-        if not index_path.exists():
-            missing_files.append('faiss_index.bin')
-        if not metadata_path.exists():
-            missing_files.append('chunks_metadata.pkl')
-        if not embeddings_path.exists():
-            missing_files.append('embeddings.npy')
-        if not config_path.exists():
-            missing_files.append('config.pkl')
-        
-        if missing_files:
-            raise FileNotFoundError(
-                f"Missing required files in {self.store_dir}: {', '.join(missing_files)}\n"
-                f"Please ensure the store/ directory contains all required files for deployment."
-            )
+        Args:
+            files: 'index', 'metadata' and 'config' filenames inside store_dir
+        """
+        print("🔄 Loading existing FAISS index...")
         
-        # Load FAISS index
-        index = faiss.read_index(str(index_path))
+        index_path = self.store_dir / files['index']
+        metadata_path = self.store_dir / files['metadata']
+        config_path = self.store_dir / files['config']
+        
+        # Load FAISS index (memory-mapped so worker processes share its pages)
+        index = faiss.read_index(
+            str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        _set_search_params(index)
         print(f"✓ Loaded FAISS index with {index.ntotal} vectors")
         
+        # Indexes built before the metric was recorded are IndexFlatL2
+        with open(config_path, 'rb') as f:
+            config = pickle.load(f)
+        self.metric = config.get('metric', 'l2')
+        
         # Load metadata
-        chunks_df = pd.read_pickle(metadata_path)
+        chunks_df = _read_metadata(metadata_path)
         print(f"✓ Loaded metadata for {len(chunks_df)} chunks")
         
         return index, chunks_df
@@ -106,45 +336,80 @@ class MedlineRetriever:
         print(f"📂 Loading data from: {data_file}")
         
         try:
-            df = pd.read_csv(data_file)
+            # Parse only the columns _prepare_chunks uses, with the
+            # multi-threaded Arrow reader; summaries may span lines
+            header = pd.read_csv(data_file, nrows=0).columns
+            title_col, text_col = self._detect_columns(header)
+            needed_cols = [title_col, text_col] + [
+                col for col in ('url', 'source_type') if col in header
+            ]
+            df = pacsv.read_csv(
+                data_file,
+                read_options=pacsv.ReadOptions(block_size=32 << 20),
+                parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                convert_options=pacsv.ConvertOptions(
+                    include_columns=needed_cols, strings_can_be_null=True
+                )
+            ).to_pandas()
             print(f"✓ Loaded {len(df)} rows from dataset")
         except Exception as e:
             raise Exception(f"Error reading CSV file: {e}")
         
         # Prepare chunks (adjust column names based on your CSV structure)
-        chunks_data = self._prepare_chunks(df)
+        chunks_df = self._prepare_chunks(df, (title_col, text_col))
         
         # Generate embeddings
-        print(f"🔄 Generating embeddings for {len(chunks_data)} chunks...")
-        texts = [chunk['chunk_text'] for chunk in chunks_data]
+        print(f"🔄 Generating embeddings for {len(chunks_df)} chunks...")
+        texts = chunks_df['chunk_text'].tolist()
+        # BGE is trained for cosine similarity: inner product over unit vectors
         embeddings = self.model.encode(
             texts, 
+            batch_size=64,
             show_progress_bar=False,
-            convert_to_numpy=True
-        )
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype('float32', copy=False)
         print(f"✓ Generated embeddings with shape {embeddings.shape}")
         
-        # Build FAISS index
         dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings.astype('float32'))
+        # Vectors are stored as int8 scalar-quantized codes: a quarter of the
+        # bytes scanned per query compared with FP32
+        if len(embeddings) < HNSW_MIN_VECTORS:
+            # Small corpora: a full scan over the codes is already fast enough
+            index = faiss.IndexScalarQuantizer(
+                dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+        elif len(embeddings) <= IVF_MIN_VECTORS:
+            index = faiss.IndexHNSWSQ(
+                dimension, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = 200
+        else:
+            # Large corpora: each query only scans the nprobe nearest clusters
+            nlist = int(4 * np.sqrt(len(embeddings)))
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit,
+                faiss.METRIC_INNER_PRODUCT
+            )
+        index.train(embeddings)
+        index.add(embeddings)
+        _set_search_params(index)
+        self.metric = 'ip'
         print(f"✓ Built FAISS index with {index.ntotal} vectors")
         
-        # Create chunks dataframe
-        chunks_df = pd.DataFrame(chunks_data)
-        
         # Save index and metadata
         self._save_index(index, chunks_df)
         
         return index, chunks_df
     
-    def _prepare_chunks(self, df: pd.DataFrame) -> List[Dict]:
-        """
-        Prepare chunks from raw dataframe.
-        Adjust this method based on your CSV structure.
+    def _detect_columns(self, columns) -> tuple:
         """
-        chunks = []
+        Pick the title and text columns from a CSV header.
         
+        Returns:
+            tuple: (title column, text column)
+        """
         # Detect column structure
         # Common variations: 'disease', 'illness', 'title', 'condition'
         # Common variations: 'symptoms', 'description', 'text', 'content'
@@ -154,64 +419,107 @@ class MedlineRetriever:
         
         # Try to detect title column
         for col in ['title', 'disease', 'illness', 'condition', 'topic']:
-            if col in df.columns:
+            if col in columns:
                 title_col = col
                 break
         
         # Try to detect text column
         for col in ['symptoms', 'description', 'text', 'content', 'summary']:
-            if col in df.columns:
+            if col in columns:
                 text_col = col
                 break
         
         if not title_col or not text_col:
             # Fallback: use first two columns
-            title_col = df.columns[0]
-            text_col = df.columns[1]
+            title_col = columns[0]
+            text_col = columns[1]
             print(f"⚠️ Using columns: '{title_col}' and '{text_col}'")
         
         print(f"📋 Using title column: '{title_col}', text column: '{text_col}'")
+        return title_col, text_col
+    
+    def _prepare_chunks(self, df: pd.DataFrame, columns: tuple = None) -> pd.DataFrame:
+        """
+        Prepare chunks from raw dataframe.
+        Adjust this method based on your CSV structure.
         
-        for idx, row in df.iterrows():
-            title = str(row[title_col])
-            text = str(row[text_col])
-            
-            # Create chunk
-            chunk = {
-                'chunk_id': f"chunk_{idx}",
-                'title': title,
-                'chunk_text': text,
-                'url': row.get('url', f"#item_{idx}"),
-                'source_type': row.get('source_type', 'medlineplus')
-            }
-            chunks.append(chunk)
+        Args:
+            df: Raw dataset
+            columns: (title column, text column), detected from df if omitted
         
-        return chunks
+        Returns:
+            DataFrame with chunk_id, title, chunk_text, url and source_type
+        """
+        title_col, text_col = columns or self._detect_columns(df.columns)
+        
+        # Assemble whole columns at once instead of one dict per row
+        row_labels = df.index.astype(str)
+        if 'url' in df.columns:
+            urls = df['url'].to_numpy()
+        else:
+            urls = ('#item_' + row_labels).to_numpy()
+        if 'source_type' in df.columns:
+            source_types = df['source_type'].to_numpy()
+        else:
+            source_types = np.full(len(df), 'medlineplus', dtype=object)
+        
+        return pd.DataFrame({
+            'chunk_id': ('chunk_' + row_labels).to_numpy(),
+            'title': df[title_col].map(str).to_numpy(),
+            'chunk_text': df[text_col].map(str).to_numpy(),
+            'url': urls,
+            'source_type': source_types
+        })
     
     def _save_index(self, index, chunks_df):
-        """Save FAISS index and metadata"""
+        """Save FAISS index, metadata and config"""
         index_path = self.store_dir / 'faiss_index.bin'
-        metadata_path = self.store_dir / 'chunks_metadata.pkl'
+        metadata_path = self.store_dir / 'chunks_metadata.parquet'
+        config_path = self.store_dir / 'config.pkl'
         
+        # The quantized codes live in the index, so no embeddings.npy is kept
         faiss.write_index(index, str(index_path))
-        chunks_df.to_pickle(metadata_path)
+        chunks_df.to_parquet(metadata_path, engine='pyarrow', compression='zstd', index=False)
+        
+        # The metric tells _load_existing_index how to read scores
+        config = {
+            'model_name': 'BAAI/bge-small-en-v1.5',
+            'total_chunks': len(chunks_df),
+            'embedding_dim': index.d,
+            'index_type': (
+                'hnsw_sq8' if isinstance(index, faiss.IndexHNSW)
+                else 'ivf_sq8' if isinstance(index, faiss.IndexIVF)
+                else 'sq8'
+            ),
+            'metric': self.metric
+        }
+        with open(config_path, 'wb') as f:
+            pickle.dump(config, f)
+        
+        # Written last, so a manifest only ever points at complete artifacts
+        _write_manifest(self.store_dir, metadata_path.name)
         
         print(f"💾 Saved FAISS index to: {index_path}")
         print(f"💾 Saved metadata to: {metadata_path}")
     
     def _load_or_build_index(self):
         """Load existing index or build new one"""
-        if self._index_exists():
-            try:
-                return self._load_existing_index()
-            except Exception as e:
-                print(f"⚠️ Error loading existing index: {e}")
-                print("🔨 Building new index...")
-                return self._build_index_from_data()
-        else:
+        files = self._read_manifest()
+        if files is None and self._index_exists():
+            # Store saved without a manifest: use the files found on disk
+            files = self._default_files()
+        
+        if files is None:
+            return self._build_index_from_data()
+        
+        try:
+            return self._load_existing_index(files)
+        except Exception as e:
+            print(f"⚠️ Error loading existing index: {e}")
+            print("🔨 Building new index...")
             return self._build_index_from_data()
     
-    def retrieve(self, query: str, top_k: int = 3) -> List[Dict]:
+    def retrieve(self, query: str, top_k: int = 3) -> RetrievalBundle:
         """
         Retrieve top-k most relevant chunks for a query.
         
@@ -223,39 +531,186 @@ class MedlineRetriever:
             List of dicts with chunk info and relevance scores
         """
         # Encode query
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
+        query_embedding = self.encode_query(query)
+        
+        return self.retrieve_with_embedding(query_embedding, top_k)
+    
+    def encode_query(self, query: str) -> np.ndarray:
+        """
+        Encode one query, re-using the embedding if it was seen recently.
         
-        # Search FAISS index
-        distances, indices = self.index.search(
-            query_embedding.astype('float32'), 
-            top_k
+        Queries that differ only in case or whitespace share an entry.
+        
+        Returns:
+            Read-only float32 vector of shape (embedding_dim,)
+        """
+        key = _query_key(query)
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(key)
+            if embedding is not None:
+                self._query_cache.move_to_end(key)
+                return embedding
+        
+        embedding = self.encode_queries([query])[0]
+        embedding.flags.writeable = False
+        with self._query_cache_lock:
+            self._query_cache[key] = embedding
+            if len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embedding
+    
+    def encode_queries(self, queries: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Encode several queries in one batched model call.
+        
+        Returns:
+            Unit-length float32 array of shape (len(queries), embedding_dim)
+        """
+        embeddings = self.model.encode(
+            queries,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True
         )
+        return embeddings.astype('float32', copy=False)
+    
+    def retrieve_with_embedding(self, query_embedding: np.ndarray, top_k: int = 3) -> RetrievalBundle:
+        """
+        Retrieve top-k chunks for an already-encoded query.
+        
+        Args:
+            query_embedding: Query vector from encode_queries
+            top_k: Number of chunks to retrieve
+        
+        Returns:
+            List of dicts with chunk info and relevance scores
+            (cosine similarity for IP indexes, higher is better). Bundles
+            are cached per embedding and shared, so treat them as read-only.
+        """
+        # The index does not change after loading, so results never go stale
+        key = (query_embedding.tobytes(), top_k)
+        with self._query_cache_lock:
+            bundle = self._result_cache.get(key)
+            if bundle is not None:
+                self._result_cache.move_to_end(key)
+                return bundle
+        
+        distances, indices = self._search(query_embedding.reshape(1, -1), top_k)
+        bundle = self._build_bundle(distances[0], indices[0])
+        with self._query_cache_lock:
+            self._result_cache[key] = bundle
+            if len(self._result_cache) > RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+        return bundle
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 3) -> List[RetrievalBundle]:
+        """
+        Retrieve top-k chunks for several queries with one encode and one search.
+        
+        Args:
+            queries: Symptom descriptions or questions
+            top_k: Number of chunks to retrieve per query
+        
+        Returns:
+            One RetrievalBundle per query, in the same order
+        """
+        if not queries:
+            return []
+        
+        if self._gpu_resources is not None:
+            distances, indices = self._search_on_gpu(queries, top_k)
+            return [
+                self._build_bundle(row_distances, row_indices)
+                for row_distances, row_indices in zip(distances, indices)
+            ]
+        
+        # encode() already length-sorts inputs, so each batch carries little padding
+        query_embeddings = self.encode_queries(queries, batch_size=64)
+        # One search for the whole block; FAISS splits its queries across threads
+        distances, indices = self._search(query_embeddings, top_k)
+        return [
+            self._build_bundle(row_distances, row_indices)
+            for row_distances, row_indices in zip(distances, indices)
+        ]
+    
+    def _search(self, query_embeddings: np.ndarray, top_k: int):
+        """Search the index for a (num_queries, dim) block of embeddings."""
+        # encode_queries already returns unit-length float32 vectors
+        queries = np.ascontiguousarray(query_embeddings, dtype='float32')
+        return self.index.search(queries, top_k)
+    
+    def _search_on_gpu(self, queries: List[str], top_k: int):
+        """
+        Encode and search without moving the embeddings off the GPU.
+        
+        The encoder returns a CUDA tensor, normalized on the device, that the
+        GPU index searches in place; only the top_k scores and ids are
+        copied back.
+        """
+        query_embeddings = self.model.encode(
+            queries,
+            batch_size=64,
+            convert_to_tensor=True,
+            normalize_embeddings=True
+        )
+        distances, indices = self.index.search(query_embeddings.float().contiguous(), top_k)
+        return distances.cpu().numpy(), indices.cpu().numpy()
+    
+    def _build_bundle(self, distances: np.ndarray, indices: np.ndarray) -> RetrievalBundle:
+        """Build results, source counts and LLM context in one pass over one query's hits."""
+        scores, ids = _valid_hits(distances, indices)
         
-        # Prepare results
         results = []
-        for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-            chunk_info = self.chunks_df.iloc[idx]
-            results.append({
-                'rank': i + 1,
-                'score': float(dist),  # Lower is better (L2 distance)
-                'title': chunk_info['title'],
-                'text': chunk_info['chunk_text'],
-                'url': chunk_info['url'],
-                'chunk_id': chunk_info['chunk_id'],
-                'source_type': chunk_info.get('source_type', 'unknown')
-            })
-        
-        return results
+        context_parts = []
+        textbook_count = 0
+        medline_count = 0
+        hits = zip(
+            scores, self._titles[ids], self._texts[ids], self._urls[ids],
+            self._chunk_ids[ids], self._source_types[ids]
+        )
+        for rank, (score, title, text, url, chunk_id, source_type) in enumerate(hits, 1):
+            result = {
+                'rank': rank,
+                'score': score,  # L2: lower is better, IP: higher is better
+                'title': title,
+                'text': text,
+                'url': url,
+                'chunk_id': chunk_id,
+                'source_type': source_type
+            }
+            results.append(result)
+            context_parts.append(_format_source(result))
+            
+            if result['source_type'] == 'textbook':
+                textbook_count += 1
+            elif result['source_type'] == 'medlineplus':
+                medline_count += 1
+        
+        return RetrievalBundle(
+            items=results,
+            textbook_count=textbook_count,
+            medline_count=medline_count,
+            formatted_context="\n---\n".join(context_parts),
+            best_score=results[0]['score'] if results else None
+        )
+    
+    def is_relevant(self, score: float, l2_threshold: float = 0.7) -> bool:
+        """
+        Check a retrieval score against the relevance threshold.
+        
+        BGE embeddings are unit length, so squared L2 distance d and cosine
+        similarity s are related by d = 2 - 2s; the same cut-off is applied
+        whichever metric the index was built with.
+        """
+        if self.metric == 'ip':
+            return score >= 1 - l2_threshold / 2
+        return score <= l2_threshold
     
     def format_context(self, results: List[Dict]) -> str:
         """Format retrieved chunks as context for LLM."""
-        context_parts = []
-        for result in results:
-            source_label = "Textbook" if result['source_type'] == 'textbook' else "MedlinePlus"
-            context_parts.append(
-                f"[Source: {source_label} - {result['title']}]\n{result['text']}\n"
-            )
-        return "\n---\n".join(context_parts)
+        if isinstance(results, RetrievalBundle):
+            return results.formatted_context
+        return "\n---\n".join(_format_source(result) for result in results)
 
 
 if __name__ == "__main__":
@@ -1,78 +1,27 @@
-import faiss
-import numpy as np
-import pandas as pd
-import pickle
+import sys
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
 
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
 
-class MedlineRetriever:
-    """Retrieves relevant medical information from FAISS index."""
-    
-    def __init__(self, store_dir: Path):
-        """Load FAISS index, embeddings, and metadata."""
-        print("🔄 Loading retriever components...")
-        
-        # Load FAISS index
-        index_path = store_dir / 'faiss_index.bin'
-        self.index = faiss.read_index(str(index_path))
-        print(f"✓ Loaded FAISS index with {self.index.ntotal} vectors")
-        
-        # Load metadata
-        metadata_path = store_dir / 'chunks_metadata.pkl'
-        self.chunks_df = pd.read_pickle(metadata_path)
-        print(f"✓ Loaded metadata for {len(self.chunks_df)} chunks")
-        
-        # Load embedding model
-        self.model = SentenceTransformer('BAAI/bge-small-en-v1.5')
-        print(f"✓ Loaded embedding model")
+from rag.retriever import MedlineRetriever as _Base
+
+
+class MedlineRetrieverLoadOnly(_Base):
+    """
+    MedlineRetriever that only loads a prebuilt store.
     
-    def retrieve(self, query: str, top_k: int = 3) -> List[Dict]:
-        """
-        Retrieve top-k most relevant chunks for a query.
-        
-        Args:
-            query: User's symptom description or question
-            top_k: Number of chunks to retrieve
-        
-        Returns:
-            List of dicts with chunk info and relevance scores
-        """
-        # Encode query
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
-        
-        # Search FAISS index
-        distances, indices = self.index.search(
-            query_embedding.astype('float32'), 
-            top_k
-        )
-        
-        # Prepare results
-        results = []
-        for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-            chunk_info = self.chunks_df.iloc[idx]
-            results.append({
-                'rank': i + 1,
-                'score': float(dist),  # Lower is better (L2 distance)
-                'title': chunk_info['title'],
-                'text': chunk_info['chunk_text'],
-                'url': chunk_info['url'],
-                'chunk_id': chunk_info['chunk_id'],
-                'source_type': chunk_info.get('source_type', 'unknown')  # NOW INCLUDED
-            })
-        
-        return results
+    Never falls back to building an index from raw data, so a missing or
+    broken store fails loudly instead of triggering a rebuild.
+    """
     
-    def format_context(self, results: List[Dict]) -> str:
-        """Format retrieved chunks as context for LLM."""
-        context_parts = []
-        for result in results:
-            source_label = "Textbook" if result['source_type'] == 'textbook' else "MedlinePlus"
-            context_parts.append(
-                f"[Source: {source_label} - {result['title']}]\n{result['text']}\n"
-            )
-        return "\n---\n".join(context_parts)
+    def _load_or_build_index(self):
+        """Load the existing index; raise if it cannot be loaded"""
+        return self._load_existing_index(self._read_manifest() or self._default_files())
+
+
+# Name used by earlier callers of this module
+MedlineRetriever = MedlineRetrieverLoadOnly
 
 
 if __name__ == "__main__":
@@ -80,7 +29,7 @@ if __name__ == "__main__":
     project_root = Path(__file__).parent.parent
     store_dir = project_root / 'store'
     
-    retriever = MedlineRetriever(store_dir)
+    retriever = MedlineRetrieverLoadOnly(store_dir)
     
     # Test query
     test_query = "I have chest pain and shortness of breath"
@@ -98,4 +47,4 @@ if __name__ == "__main__":
     print("\n" + "="*60)
     print("📄 Formatted Context:")
     print("="*60)
-    print(retriever.format_context(results[:3]))
\ No newline at end of file
+    print(retriever.format_context(results[:3]))
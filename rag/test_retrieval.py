@@ -29,14 +29,14 @@ def test_retrieval():
         "cough and sore throat"
     ]
     
-    for i, query in enumerate(test_queries, 1):
+    # Retrieve top 5 results for every query in one batched encode + search
+    all_results = retriever.retrieve_batch(test_queries, top_k=5)
+    
+    for i, (query, results) in enumerate(zip(test_queries, all_results), 1):
         print(f"\n{'='*70}")
         print(f"TEST QUERY {i}: {query}")
         print(f"{'='*70}")
         
-        # Retrieve top 5 results
-        results = retriever.retrieve(query, top_k=5)
-        
         # Show results
         for result in results:
             source_emoji = "📖" if result['source_type'] == 'textbook' else "📚"
@@ -45,13 +45,9 @@ def test_retrieval():
             print(f"   Score: {result['score']:.3f}")
             print(f"   Text: {result['text'][:200]}...")
         
-        # Count sources
-        textbook_count = sum(1 for r in results if r['source_type'] == 'textbook')
-        medline_count = sum(1 for r in results if r['source_type'] == 'medlineplus')
-        
         print(f"\n📊 Source distribution:")
-        print(f"   Textbook: {textbook_count}/5")
-        print(f"   MedlinePlus: {medline_count}/5")
+        print(f"   Textbook: {results.textbook_count}/5")
+        print(f"   MedlinePlus: {results.medline_count}/5")
     
     print(f"\n{'='*70}")
     print("✅ RETRIEVAL TEST COMPLETE!")
@@ -1,20 +1,46 @@
 import json
+import sys
 import pandas as pd
 from pathlib import Path
-import xml.etree.ElementTree as ET
+from lxml import etree
 import html
 import re
 
+# Run as a script from rag/, so make the project root importable
+PROJECT_ROOT = str(Path(__file__).parent.parent)
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from rag.chunker import chunk_text_with_overlap, TEXTBOOK_CHUNK_WORDS, TEXTBOOK_CHUNK_OVERLAP
+
+# Summary cleaning patterns, compiled once at import
+_TAG_RE = re.compile(r'<[^>]+>')
+_WS_RE = re.compile(r'\s+')
+
+TEXTBOOK_TITLE = 'Symptom to Diagnosis - Evidence-Based Guide'
+
+# Textbook sections use the chunker's textbook size and overlap. The
+# chunker prefixes each section with "<title>. ", so sections leave room
+# for it and still come out as exactly one chunk each
+TEXTBOOK_SECTION_WORDS = TEXTBOOK_CHUNK_WORDS - len(f"{TEXTBOOK_TITLE}.".split())
+
+
+def _release(element):
+    """Free a parsed element and any already-processed siblings before it."""
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
 def parse_medlineplus_xml(xml_path: Path) -> pd.DataFrame:
     """Parse MedlinePlus XML data (your existing data)."""
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    
     topics = []
     
-    for health_topic in root.findall('health-topic'):
+    # Stream topics one at a time so peak memory is one topic, not the file
+    for _, health_topic in etree.iterparse(str(xml_path), events=('end',), tag='health-topic'):
         language = health_topic.get('language', '')
         if language != 'English':
+            _release(health_topic)
             continue
         
         title = health_topic.get('title', '')
@@ -27,11 +53,13 @@ def parse_medlineplus_xml(xml_path: Path) -> pd.DataFrame:
         full_summary = health_topic.find('full-summary')
         if full_summary is not None and full_summary.text:
             summary = html.unescape(full_summary.text)
-            summary = re.sub(r'<[^>]+>', ' ', summary)
-            summary = re.sub(r'\s+', ' ', summary).strip()
+            summary = _TAG_RE.sub(' ', summary)
+            summary = _WS_RE.sub(' ', summary).strip()
         else:
             summary = ''
         
+        _release(health_topic)
+        
         if not summary or len(summary) < 50:
             continue
         
@@ -54,22 +82,25 @@ def load_textbook_json(json_path: Path) -> pd.DataFrame:
     with open(json_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     
-    # The textbook is one large document
-    # I'll create a single entry for now
+    # The textbook is one large document; split it into overlapping
+    # sections so no single record carries the whole book
     textbook_title = list(data.keys())[0]
     textbook_content = data[textbook_title]
+    sections = chunk_text_with_overlap(
+        textbook_content, TEXTBOOK_SECTION_WORDS, TEXTBOOK_CHUNK_OVERLAP
+    )
     
     records = [{
-        'id': 'textbook_full',
-        'title': 'Symptom to Diagnosis - Evidence-Based Guide',
+        'id': f'textbook_{i}',
+        'title': TEXTBOOK_TITLE,
         'also_called': '',
-        'summary': textbook_content,
+        'summary': section,
         'url': 'textbook://symptom_to_diagnosis',
         'source_type': 'textbook'
-    }]
+    } for i, section in enumerate(sections)]
     
     df = pd.DataFrame(records)
-    print(f"✓ Loaded textbook ({len(textbook_content):,} characters)")
+    print(f"✓ Loaded textbook ({len(textbook_content):,} characters, {len(df)} sections)")
     return df
 
 
@@ -100,7 +131,7 @@ def create_unified_dataset():
     print(f"{'='*70}")
     print(f"   Total documents: {len(unified_df)}")
     print(f"   - MedlinePlus topics: {len(medlineplus_df)}")
-    print(f"   - Textbook: {len(textbook_df)}")
+    print(f"   - Textbook sections: {len(textbook_df)}")
     print(f"   Total characters: {unified_df['summary'].str.len().sum():,}")
     
     # Save
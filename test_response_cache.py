@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from rag.response_cache import ResponseCache
+
+def test_answers_not_shared():
+    """Summaries that differ only in a follow-up answer must not share a diagnosis."""
+
+    print("="*70)
+    print("TESTING RESPONSE CACHE KEYS")
+    print("="*70)
+
+    # Cache keys as RAGPipeline builds them with normalize_query
+    mild = "i have a fever and a headache. fever: mild, about 99°f"
+    high = "i have a fever and a headache. fever: very high, above 104°f"
+
+    cache = ResponseCache()
+    cache.insert(mild, {'diagnosis': 'Likely a mild viral infection.'})
+
+    assert cache.lookup(high) is None, "Different answers shared a diagnosis"
+    print("\n✅ Different answer: cache miss")
+
+    hit = cache.lookup(mild)
+    assert hit is not None and hit['diagnosis'] == 'Likely a mild viral infection.'
+    print("✅ Same normalized text: cache hit")
+
+    print(f"\n{'='*70}")
+    print("✅ TEST COMPLETE")
+    print(f"{'='*70}")
+
+
+def test_expired_and_evicted():
+    """Entries past their TTL or beyond max_entries are not served."""
+
+    expired = ResponseCache(ttl_seconds=-1)
+    expired.insert("cough", {'diagnosis': 'Common cold.'})
+    assert expired.lookup("cough") is None
+    print("✅ Expired entry: cache miss")
+
+    small = ResponseCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        small.insert(key, {'diagnosis': key})
+    assert small.lookup("a") is None and small.lookup("c") is not None
+    print("✅ Least recently used entry evicted")
+
+
+if __name__ == "__main__":
+    test_answers_not_shared()
+    test_expired_and_evicted()
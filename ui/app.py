@@ -1,12 +1,65 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import jinja2
 from pathlib import Path
+import os
 import sys
+import threading
+import time
 from datetime import datetime
 
-# Add parent directory to path
-sys.path.append(str(Path(__file__).parent.parent))
+# Add parent directory to path; Streamlit re-executes this file on every
+# rerun, so only add it once
+PROJECT_ROOT = str(Path(__file__).parent.parent)
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
 
-from rag.rag_pipeline import RAGPipeline, ConversationManagerWithFollowUps
+# rag.rag_pipeline pulls in torch, sentence-transformers and FAISS, so it is
+# imported inside the functions below, after the page chrome has rendered
+
+# Streamed text is pushed to the page every STREAM_BATCH chunks or
+# STREAM_MS milliseconds, whichever comes first
+STREAM_BATCH = int(os.getenv('DOCTORBOT_STREAM_BATCH', '12'))
+STREAM_MS = float(os.getenv('DOCTORBOT_STREAM_MS', '40'))
+
+# Chat messages drawn on each full run; older ones are drawn on request.
+# The conversation state keeps the full history for the LLM either way
+MAX_RENDERED_MESSAGES = 20
+
+# Static sidebar, sent as a single element instead of one per heading,
+# paragraph and list
+SIDEBAR_HTML = """
+<h2>About</h2>
+<p>DoctorBot analyzes symptoms using evidence-based medical knowledge from textbooks and MedlinePlus.</p>
+<hr>
+<h2>Features</h2>
+<ul class="feature-list">
+    <li>Emergency symptom detection</li>
+    <li>Follow-up questions</li>
+    <li>Evidence-based diagnosis</li>
+    <li>Dual knowledge sources</li>
+</ul>
+<hr>
+<h2>Privacy</h2>
+<ul class="feature-list">
+    <li>Secure & Private</li>
+    <li>Not stored</li>
+    <li>For screening only</li>
+</ul>
+<hr>
+<p><small>🕐 Always consult a healthcare provider for medical advice</small></p>
+"""
+
+# One source column; compiled once, and autoescape keeps retrieved titles
+# and URLs from injecting markup. Rows show the label if given, else a link
+SOURCES_TEMPLATE = jinja2.Environment(autoescape=True).from_string(
+    '<div class="source-section"><h4>{{ heading }}</h4>'
+    '{% for source in sources %}<div class="source-item">{{ loop.index }}. '
+    '{% if label %}{{ label }}'
+    '{% else %}<a href="{{ source.url }}" target="_blank" rel="noopener">{{ source.title }}</a>{% endif %}'
+    '<br><small>Relevance: {{ "%.3f"|format(source.relevance_score) }}</small></div>'
+    '{% endfor %}</div>'
+)
 
 
 # Page config
@@ -14,308 +67,77 @@ st.set_page_config(
     page_title="DoctorBot | Medical Symptom Checker",
     page_icon="🩺",
     layout="wide",
-    initial_sidebar_state="expanded"
+    # Expanded on desktop, collapsed on narrow (mobile) screens
+    initial_sidebar_state="auto"
 )
 
-#  CSS with visible buttons
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
-    
-    * {
-        font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-    }
-    
-    .main {
-        background-color: #ffffff !important;
-    }
-    
-    .block-container {
-        padding: 2rem 1rem;
-        max-width: 900px;
-        background-color: #ffffff !important;
-    }
-    
-    .main-header {
-        text-align: center;
-        padding: 2rem 0 1rem 0;
-        border-bottom: 2px solid #000000;
-        margin-bottom: 2rem;
-        background-color: #ffffff;
-    }
-    
-    .main-title {
-        font-size: 2.5rem;
-        font-weight: 700;
-        color: #000000 !important;
-        margin: 0;
-    }
-    
-    .main-subtitle {
-        font-size: 1.1rem;
-        color: #666666 !important;
-        margin-top: 0.5rem;
-    }
-    
-    /* Buttons - highly visible blue */
-    .stButton>button {
-        background-color: #0066cc !important;
-        color: #ffffff !important;
-        border: none !important;
-        border-radius: 8px;
-        padding: 0.875rem 2rem;
-        font-weight: 600;
-        font-size: 1.05rem;
-        transition: all 0.2s;
-        width: 100%;
-        box-shadow: 0 2px 8px rgba(0, 102, 204, 0.3) !important;
-    }
-    
-    .stButton>button:hover {
-        background-color: #0052a3 !important;
-        color: #ffffff !important;
-        box-shadow: 0 4px 12px rgba(0, 102, 204, 0.4) !important;
-        transform: translateY(-1px);
-    }
-    
-    .stButton>button:active {
-        transform: translateY(0);
-    }
-    
-    /* Text inputs */
-    .stTextArea textarea, .stTextInput input {
-        border: 2px solid #cccccc !important;
-        border-radius: 8px;
-        padding: 1rem;
-        font-size: 1rem;
-        color: #000000 !important;
-        background: #ffffff !important;
-    }
-    
-    .stTextArea textarea:focus, .stTextInput input:focus {
-        border-color: #0066cc !important;
-        outline: none;
-        box-shadow: 0 0 0 3px rgba(0, 102, 204, 0.1) !important;
-    }
-    
-    /* Info boxes */
-    .info-box {
-        background: #f0f7ff !important;
-        border: 1px solid #b3d9ff !important;
-        border-left: 4px solid #0066cc !important;
-        padding: 1.25rem;
-        margin: 1rem 0;
-        border-radius: 8px;
-        color: #000000 !important;
-    }
-    
-    .info-box strong {
-        color: #000000 !important;
-        display: block;
-        margin-bottom: 0.5rem;
-        font-size: 1.1rem;
-    }
-    
-    /* Emergency box */
-    .emergency-box {
-        background: #fff5f5 !important;
-        border: 2px solid #dc3545 !important;
-        border-left: 6px solid #dc3545 !important;
-        padding: 1.5rem;
-        margin: 1.5rem 0;
-        border-radius: 8px;
-        color: #000000 !important;
-    }
-    
-    .emergency-title {
-        color: #dc3545 !important;
-        font-size: 1.5rem;
-        font-weight: 700;
-        margin: 0 0 1rem 0;
-    }
-    
-    /* Success box */
-    .success-box {
-        background: #f0f9f4 !important;
-        border: 2px solid #28a745 !important;
-        border-left: 6px solid #28a745 !important;
-        padding: 1.25rem;
-        margin: 1rem 0;
-        border-radius: 8px;
-        color: #000000 !important;
-    }
-    
-    /* Warning box */
-    .warning-box {
-        background: #fffbf0 !important;
-        border: 2px solid #ffc107 !important;
-        border-left: 6px solid #ffc107 !important;
-        padding: 1.25rem;
-        margin: 1rem 0;
-        border-radius: 8px;
-        color: #000000 !important;
-    }
-    
-    /* Progress */
-    .progress-box {
-        background: #e7f3ff !important;
-        border: 2px solid #0066cc !important;
-        border-radius: 8px;
-        padding: 1rem;
-        margin: 1rem 0;
-        text-align: center;
-        color: #000000 !important;
-    }
-    
-    .progress-box strong {
-        color: #0066cc !important;
-        font-size: 1.1rem;
-    }
-    
-    /* RAG container */
-    .rag-container {
-        background: #ffffff !important;
-        border: 2px solid #dee2e6 !important;
-        border-radius: 8px;
-        padding: 1.5rem;
-        margin: 1.5rem 0;
-    }
-    
-    .rag-status {
-        font-weight: 600;
-        color: #000000 !important;
-        margin-bottom: 0.5rem;
-        font-size: 1.1rem;
-    }
-    
-    .rag-detail {
-        color: #666666 !important;
-        font-size: 0.95rem;
-        margin: 0.25rem 0;
-    }
-    
-    /* Source items */
-    .source-section {
-        margin-top: 1.5rem;
-    }
-    
-    .source-section h4 {
-        color: #000000 !important;
-        font-size: 1rem;
-        font-weight: 600;
-        margin-bottom: 0.75rem;
-    }
-    
-    .source-item {
-        background: #f8f9fa !important;
-        border: 1px solid #dee2e6 !important;
-        border-radius: 6px;
-        padding: 0.75rem 1rem;
-        margin: 0.5rem 0;
-        color: #000000 !important;
-    }
-    
-    .source-item a {
-        color: #0066cc !important;
-        text-decoration: none;
-        font-weight: 500;
-    }
-    
-    .source-item a:hover {
-        text-decoration: underline;
-    }
-    
-    /* Sidebar */
-    section[data-testid="stSidebar"] {
-        background-color: #f8f9fa !important;
-        border-right: 1px solid #dee2e6;
-    }
-    
-    section[data-testid="stSidebar"] * {
-        color: #000000 !important;
-    }
-    
-    section[data-testid="stSidebar"] h2 {
-        color: #000000 !important;
-        font-weight: 600;
-    }
-    
-    /* Chat messages */
-    .stChatMessage {
-        background: #ffffff !important;
-        border: 1px solid #dee2e6 !important;
-        border-radius: 8px;
-        padding: 1rem;
-        margin: 1rem 0;
-    }
-    
-    .stChatMessage * {
-        color: #000000 !important;
-    }
-    
-    /* Expander */
-    .streamlit-expanderHeader {
-        background-color: #f8f9fa !important;
-        border: 1px solid #dee2e6 !important;
-        border-radius: 8px;
-        color: #000000 !important;
-        font-weight: 600;
-    }
-    
-    /* Remove branding */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    
-    /* Text colors */
-    p, span, div, label, li {
-        color: #000000 !important;
-    }
-    
-    a {
-        color: #0066cc !important;
-    }
-    
-    hr {
-        border: none;
-        border-top: 1px solid #dee2e6;
-        margin: 2rem 0;
-    }
-    
-    /* Feature list */
-    .feature-list {
-        list-style: none;
-        padding: 0;
-        margin: 0;
-    }
-    
-    .feature-list li {
-        padding: 0.5rem 0;
-        color: #000000 !important;
-    }
-    
-    .feature-list li:before {
-        content: "✓ ";
-        color: #28a745;
-        font-weight: bold;
-        margin-right: 0.5rem;
-    }
-</style>
-""", unsafe_allow_html=True)
+
+@st.cache_resource
+def load_css():
+    """Stylesheet from static/app.css, read from disk once per process."""
+    return (Path(__file__).parent / 'static' / 'app.css').read_text(encoding='utf-8')
+
+
+# Injected on every run: elements a rerun does not emit are removed from the page
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
 
 
 @st.cache_resource
 def load_pipeline():
+    from rag.rag_pipeline import RAGPipeline
+    
     project_root = Path(__file__).parent.parent
     store_dir = project_root / 'store'
     return RAGPipeline(store_dir)
 
 
+@st.cache_resource
+def get_engine():
+    """Conversation engine shared by every session; sessions only hold a ConversationState."""
+    from rag.rag_pipeline import ConversationEngine
+    
+    return ConversationEngine(load_pipeline(), num_followups=3)
+
+
+def warm_engine():
+    """Background warmup target; failures are logged instead of lost with the thread."""
+    try:
+        get_engine().pipeline.warmup()
+    except Exception as e:
+        # Nothing is cached on failure, so the first query loads the engine
+        # again and reports the error to the user
+        print(f"⚠️ Background warmup failed: {e}")
+
+
+@st.cache_resource
+def start_warmup():
+    """
+    Build and warm the engine in a background thread, once per process.
+    
+    The first page paint no longer waits for it, and by the time the user
+    submits symptoms the model, index and API connections are ready.
+    get_engine is cached, so a query arriving mid-warmup waits for the
+    same load instead of starting a second one.
+    """
+    thread = threading.Thread(target=warm_engine, name='doctorbot-warmup', daemon=True)
+    # The cached loaders expect a script run context; lend the thread the
+    # context of the run that started it
+    add_script_run_ctx(thread, get_script_run_ctx())
+    thread.start()
+    return thread
+
+
+def new_conversation_state():
+    from rag.rag_pipeline import ConversationState
+    
+    return ConversationState()
+
+
 def initialize_session_state():
     if 'messages' not in st.session_state:
         st.session_state.messages = []
-    if 'conversation_manager' not in st.session_state:
-        pipeline = load_pipeline()
-        st.session_state.conversation_manager = ConversationManagerWithFollowUps(pipeline, num_followups=3)
+    if 'conversation_state' not in st.session_state:
+        st.session_state.conversation_state = new_conversation_state()
     if 'stage' not in st.session_state:
         st.session_state.stage = 'initial'
     if 'current_question_num' not in st.session_state:
@@ -334,39 +156,13 @@ def render_header():
 def render_sidebar():
     """Clean sidebar without emergency box."""
     with st.sidebar:
-        st.markdown("## About")
-        st.write("DoctorBot analyzes symptoms using evidence-based medical knowledge from textbooks and MedlinePlus.")
-        
-        st.markdown("---")
-        
-        st.markdown("## Features")
-        st.markdown("""
-        <ul class="feature-list">
-            <li>Emergency symptom detection</li>
-            <li>Follow-up questions</li>
-            <li>Evidence-based diagnosis</li>
-            <li>Dual knowledge sources</li>
-        </ul>
-        """, unsafe_allow_html=True)
-        
-        st.markdown("---")
-        
-        st.markdown("## Privacy")
-        st.markdown("""
-        <ul class="feature-list">
-            <li>Secure & Private</li>
-            <li>Not stored</li>
-            <li>For screening only</li>
-        </ul>
-        """, unsafe_allow_html=True)
-        
-        st.markdown("---")
-        
-        st.caption("🕐 Always consult a healthcare provider for medical advice")
+        st.html(SIDEBAR_HTML)
 
 
 def display_emergency_alert(response):
-    categories_text = ', '.join(response['categories'])
+    categories_text = response.get('categories_text')
+    if categories_text is None:
+        categories_text = ', '.join(response['categories'])
     
     st.markdown(f"""
     <div class="emergency-box">
@@ -397,6 +193,8 @@ def display_rag_info(metadata):
     used_rag = metadata.get('used_rag', False)
     reason = metadata.get('reason', 'Unknown')
     sources = metadata.get('sources', [])
+    # Grouped by source type in the pipeline
+    by_type = metadata.get('sources_by_type', {})
     
     status_icon = "✅" if used_rag else "ℹ️"
     status_text = "Using Medical Knowledge Base" if used_rag else "Using General AI Knowledge"
@@ -411,46 +209,32 @@ def display_rag_info(metadata):
     if used_rag and sources:
         st.markdown("### 📚 Referenced Sources")
         
-        textbook_sources = [s for s in sources if s['source_type'] == 'textbook']
-        medline_sources = [s for s in sources if s['source_type'] == 'medlineplus']
-        
         col1, col2 = st.columns(2)
         
         with col1:
+            textbook_sources = by_type.get('textbook')
             if textbook_sources:
-                st.markdown("""
-                <div class="source-section">
-                    <h4>📖 Clinical Textbook</h4>
-                """, unsafe_allow_html=True)
-                for i, source in enumerate(textbook_sources, 1):
-                    st.markdown(f"""
-                    <div class="source-item">
-                        {i}. Symptom to Diagnosis<br>
-                        <small>Relevance: {source['relevance_score']:.3f}</small>
-                    </div>
-                    """, unsafe_allow_html=True)
-                st.markdown("</div>", unsafe_allow_html=True)
+                st.markdown(SOURCES_TEMPLATE.render(
+                    heading="📖 Clinical Textbook",
+                    sources=textbook_sources,
+                    label="Symptom to Diagnosis"
+                ), unsafe_allow_html=True)
         
         with col2:
+            medline_sources = by_type.get('medlineplus')
             if medline_sources:
-                st.markdown("""
-                <div class="source-section">
-                    <h4>📚 MedlinePlus</h4>
-                """, unsafe_allow_html=True)
-                for i, source in enumerate(medline_sources, 1):
-                    st.markdown(f"""
-                    <div class="source-item">
-                        {i}. <a href="{source['url']}" target="_blank">{source['title']}</a><br>
-                        <small>Relevance: {source['relevance_score']:.3f}</small>
-                    </div>
-                    """, unsafe_allow_html=True)
-                st.markdown("</div>", unsafe_allow_html=True)
+                st.markdown(SOURCES_TEMPLATE.render(
+                    heading="📚 MedlinePlus",
+                    sources=medline_sources
+                ), unsafe_allow_html=True)
 
 
 def main():
-    initialize_session_state()
+    # Static chrome first, so it shows before the first heavy import
     render_header()
     render_sidebar()
+    start_warmup()
+    initialize_session_state()
     
     # Disclaimer
     with st.expander("⚠️ Medical Disclaimer", expanded=False):
@@ -466,8 +250,25 @@ def main():
     
     st.markdown("---")
     
-    # Display messages
-    for message in st.session_state.messages:
+    # Transcript as of this run; turns taken inside the fragment below
+    # are rendered by the fragment until the next full rerun
+    messages = st.session_state.messages
+    st.session_state.rendered_messages = len(messages)
+    render_transcript(messages, "show_earlier_messages")
+    
+    render_conversation()
+
+
+def render_transcript(messages, toggle_key):
+    """Draw the last MAX_RENDERED_MESSAGES messages, with a toggle for the rest."""
+    hidden = len(messages) - MAX_RENDERED_MESSAGES
+    if hidden > 0 and st.toggle(f"Show {hidden} earlier messages", key=toggle_key):
+        render_messages(messages[:hidden])
+    render_messages(messages[-MAX_RENDERED_MESSAGES:])
+
+
+def render_messages(messages):
+    for message in messages:
         role = message["role"]
         content = message["content"]
         
@@ -476,10 +277,33 @@ def main():
                 display_emergency_alert({
                     'content': content,
                     'severity': message.get('severity', 'HIGH'),
-                    'categories': message.get('categories', [])
+                    'categories': message.get('categories', []),
+                    'categories_text': message.get('categories_text')
                 })
             else:
                 st.markdown(content)
+
+
+@st.fragment
+def render_conversation():
+    """
+    Everything below the transcript.
+    
+    Submitting input reruns only this fragment, so earlier chat messages
+    are not re-sent; only starting a new assessment reruns the whole app.
+    """
+    # Capped like the full-run transcript, since many turns can pass
+    # before the next full rerun
+    render_transcript(
+        st.session_state.messages[st.session_state.rendered_messages:],
+        "show_earlier_fragment_messages"
+    )
+    
+    # Input queued by a submit button; handled before the input area is drawn
+    # so the form below already reflects the new stage
+    user_input = st.session_state.pop('pending_input', None)
+    if user_input:
+        process_input(user_input)
     
     # Complete
     if st.session_state.stage == 'complete':
@@ -496,8 +320,7 @@ def main():
         with col2:
             if st.button("Start New Assessment", use_container_width=True):
                 st.session_state.messages = []
-                pipeline = load_pipeline()
-                st.session_state.conversation_manager = ConversationManagerWithFollowUps(pipeline, num_followups=3)
+                st.session_state.conversation_state.reset()
                 st.session_state.stage = 'initial'
                 st.session_state.current_question_num = 0
                 if 'metadata' in st.session_state:
@@ -522,31 +345,89 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        user_input = st.text_area(
-            "Your symptoms:",
-            placeholder="Example: I've had a persistent fever of 101°F for 3 days, with severe headaches...",
-            height=150,
-            key="symptom_input"
-        )
-        
-        col1, col2, col3 = st.columns([1, 1, 1])
-        with col2:
-            submit = st.button("Analyze Symptoms", type="primary", use_container_width=True)
-        
-        if submit and user_input.strip():
-            process_input(user_input)
-            st.rerun()
+        # A form reruns the script only on submit, not on every widget edit
+        with st.form("symptom_form"):
+            st.text_area(
+                "Your symptoms:",
+                placeholder="Example: I've had a persistent fever of 101°F for 3 days, with severe headaches...",
+                height=150,
+                key="symptom_input"
+            )
+            
+            col1, col2, col3 = st.columns([1, 1, 1])
+            with col2:
+                st.form_submit_button(
+                    "Analyze Symptoms",
+                    type="primary",
+                    use_container_width=True,
+                    on_click=queue_input,
+                    args=("symptom_input",)
+                )
     
     elif st.session_state.stage == 'followup':
-        user_input = st.text_input(
-            "Your answer:",
-            key=f"followup_input_{st.session_state.current_question_num}"
-        )
-        
-        if st.button("Submit Answer", type="primary"):
-            if user_input.strip():
-                process_input(user_input)
-                st.rerun()
+        input_key = f"followup_input_{st.session_state.current_question_num}"
+        with st.form(f"followup_{st.session_state.current_question_num}", clear_on_submit=True):
+            st.text_input("Your answer:", key=input_key)
+            st.form_submit_button("Submit Answer", type="primary", on_click=queue_input, args=(input_key,))
+
+
+def queue_input(key):
+    """Submit callback: pass the form's text to the fragment run it triggers."""
+    user_input = st.session_state[key]
+    if user_input.strip():
+        st.session_state.pending_input = user_input
+
+
+def batch_tokens(tokens, max_tokens=STREAM_BATCH, max_ms=STREAM_MS):
+    """
+    Coalesce streamed chunks so the page re-renders per batch, not per token.
+    
+    The first chunk is passed through at once to keep time-to-first-token;
+    after that a batch is flushed once it holds max_tokens chunks or is
+    max_ms old.
+    """
+    tokens = iter(tokens)
+    for first in tokens:
+        yield first
+        break
+    
+    buffer = []
+    deadline = None
+    for token in tokens:
+        buffer.append(token)
+        now = time.monotonic()
+        if deadline is None:
+            deadline = now + max_ms / 1000
+        if len(buffer) >= max_tokens or now >= deadline:
+            yield "".join(buffer)
+            buffer.clear()
+            deadline = None
+    
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_response(first_event, events):
+    """
+    Render a streamed diagnosis as it arrives.
+    
+    Returns:
+        The response dict carried by the stream's final event
+    """
+    final = {}
+    
+    def tokens():
+        yield first_event['text']
+        for event in events:
+            if event['kind'] == 'token':
+                yield event['text']
+            else:
+                final.update(event['response'])
+    
+    with st.chat_message("assistant", avatar="🩺"):
+        st.write_stream(batch_tokens(tokens()))
+    
+    return final
 
 
 def process_input(user_input):
@@ -554,9 +435,19 @@ def process_input(user_input):
         "role": "user",
         "content": user_input
     })
+    first_reply = len(st.session_state.messages)
+    render_messages(st.session_state.messages[-1:])
     
+    events = get_engine().process_message_stream(st.session_state.conversation_state, user_input)
+    
+    # Triage and follow-up questions arrive whole; only a diagnosis streams
     with st.spinner("Processing..."):
-        response = st.session_state.conversation_manager.process_message(user_input)
+        first_event = next(events)
+    
+    if first_event['kind'] == 'final':
+        response = first_event['response']
+    else:
+        response = stream_response(first_event, events)
     
     response_type = response['type']
     
@@ -566,7 +457,9 @@ def process_input(user_input):
             "content": response['content'],
             "is_emergency": True,
             "severity": response['severity'],
-            "categories": response['categories']
+            "categories": response['categories'],
+            # Joined once here rather than on every replay of the transcript
+            "categories_text": ', '.join(response['categories'])
         })
         st.session_state.stage = 'emergency'
     
@@ -593,10 +486,15 @@ def process_input(user_input):
         st.session_state.stage = 'complete'
         st.session_state.metadata = {
             'sources': response.get('sources', []),
+            'sources_by_type': response.get('sources_by_type', {}),
             'used_rag': response.get('used_rag', False),
             'reason': response.get('reason', 'Unknown'),
             'best_score': response.get('best_score')
         }
+    
+    # A streamed reply is already on the page
+    if first_event['kind'] == 'final':
+        render_messages(st.session_state.messages[first_reply:])
 
 
 if __name__ == "__main__":